@@ -0,0 +1,626 @@
+#! /usr/bin/env python3
+# vim:set ts=4 sw=4 et:
+
+import sys
+import os
+import io
+import gzip
+import hashlib
+import argparse
+import time
+import tracemalloc
+import tempfile
+import shutil
+import random
+import contextlib
+import lzma
+import threading
+import http.server
+
+import check
+
+
+def legacy_packages(f, inserter, filename):
+    """
+    ancienne analyse des fichiers Packages (readlines), pour comparaison
+    """
+    filename = ""
+    size = None
+    md5 = None
+    nb = 0
+
+    def is_key(a, b):
+        return a.lower().startswith((b + ":").lower())
+
+    def get_val(a):
+        return a[a.find(":") + 1 :].lstrip()
+
+    for i in f.readlines():
+        i = i.decode("utf-8").rstrip()
+        if i == "":
+            if filename != "":
+                inserter(filename, size, md5)
+                nb += 1
+            filename = ""
+            size = None
+            md5 = None
+        elif is_key(i, "Filename"):
+            filename = get_val(i)
+        elif is_key(i, "Size"):
+            size = int(get_val(i))
+        elif is_key(i, "MD5sum"):
+            md5 = get_val(i)
+
+    if filename != "":
+        inserter(filename, size, md5)
+        nb += 1
+    return nb
+
+
+def legacy_sources(f, inserter, filename):
+    """
+    ancienne analyse des fichiers Sources (readlines), pour comparaison
+    """
+    in_files = False
+    directory = ""
+    files = []
+    nb = 0
+
+    def finish():
+        nonlocal nb
+        if directory != "":
+            for i in files:
+                inserter(os.path.join(directory, i[0]), int(i[1]), i[2])
+                nb += 1
+
+    for i in f.readlines():
+        i = i.decode("utf-8").rstrip()
+        if i == "":
+            finish()
+            in_files = False
+            directory = ""
+            files = []
+        if in_files:
+            if i[0] == " " or i[0] == "\t":
+                i = i.lstrip().split(" ")
+                files.append((i[2], i[1], i[0]))
+            else:
+                in_files = False
+        if i == "Checksums-Sha256:":
+            in_files = True
+        elif i[0:10] == "Directory:":
+            directory = i[10:].lstrip()
+
+    finish()
+    return nb
+
+
+def synthetic_packages(count):
+    """
+    contenu d'un fichier Packages de count paquets, proche d'un vrai catalogue
+    """
+    out = io.BytesIO()
+    for i in range(count):
+        name = "package{}".format(i)
+        h = hashlib.sha256(name.encode()).hexdigest()
+        out.write(
+            (
+                "Package: {name}\n"
+                "Version: 1.{i}-1\n"
+                "Installed-Size: {i}\n"
+                "Maintainer: Debian Maintainers <debian@example.org>\n"
+                "Architecture: amd64\n"
+                "Depends: libc6 (>= 2.14), libfoo{i} (= 1.{i}-1)\n"
+                "Description: synthetic package {i}\n"
+                " A longer description of the synthetic package,\n"
+                " spanning several continuation lines.\n"
+                " .\n"
+                " Nothing to see here.\n"
+                "Homepage: https://example.org/{name}\n"
+                "Description-md5: {md5}\n"
+                "Section: misc\n"
+                "Priority: optional\n"
+                "Filename: pool/main/{p}/{name}/{name}_1.{i}-1_amd64.deb\n"
+                "Size: {size}\n"
+                "MD5sum: {md5}\n"
+                "SHA256: {sha256}\n"
+                "\n"
+            ).format(name=name, i=i, p=name[0], size=1000 + i, md5=h[:32], sha256=h).encode()
+        )
+    return out.getvalue()
+
+
+def synthetic_sources(count):
+    """
+    contenu d'un fichier Sources de count paquets source
+    """
+    out = io.BytesIO()
+    for i in range(count):
+        name = "source{}".format(i)
+        h = hashlib.sha256(name.encode()).hexdigest()
+        out.write(
+            (
+                "Package: {name}\n"
+                "Binary: {name}, lib{name}-dev\n"
+                "Version: 1.{i}-1\n"
+                "Maintainer: Debian Maintainers <debian@example.org>\n"
+                "Build-Depends: debhelper (>= 11)\n"
+                "Architecture: any\n"
+                "Format: 3.0 (quilt)\n"
+                "Files:\n"
+                " {md5} 1234 {name}_1.{i}-1.dsc\n"
+                " {md5} 123456 {name}_1.{i}.orig.tar.xz\n"
+                " {md5} 4567 {name}_1.{i}-1.debian.tar.xz\n"
+                "Checksums-Sha256:\n"
+                " {sha256} 1234 {name}_1.{i}-1.dsc\n"
+                " {sha256} 123456 {name}_1.{i}.orig.tar.xz\n"
+                " {sha256} 4567 {name}_1.{i}-1.debian.tar.xz\n"
+                "Directory: pool/main/{p}/{name}\n"
+                "Priority: source\n"
+                "Section: misc\n"
+                "\n"
+            ).format(name=name, i=i, p=name[0], md5=h[:32], sha256=h).encode()
+        )
+    return out.getvalue()
+
+
+def _open(filename):
+    """
+    ouvre un catalogue, éventuellement compressé
+    """
+    mod, _ = check.mirror._catalog_kind(filename)
+    if mod is None:
+        mod = gzip if filename.endswith(".gz") else io
+    return mod.open(filename, "rb")
+
+
+def _measure(func, opener, label):
+    """
+    exécute func sur le flux fourni par opener: durée, puis pic mémoire
+    """
+    rows = []
+    t = time.perf_counter()
+    with opener() as f:
+        nb = func(f, lambda filename, size, md5: rows.append((filename, size, md5)), label)
+    t = time.perf_counter() - t
+
+    tracemalloc.start()
+    with opener() as f:
+        func(f, lambda filename, size, md5: None, label)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return nb, t, peak, rows
+
+
+def bench_parser(args):
+    """
+    compare l'ancienne et la nouvelle analyse des catalogues
+    """
+    inputs = []
+    for filename in args.files:
+        name = os.path.basename(filename).split(".")[0]
+        inputs.append((name, filename, lambda filename=filename: _open(filename)))
+    if not inputs:
+        data = synthetic_packages(args.count)
+        inputs.append(("Packages", "synthetic Packages", lambda: io.BytesIO(data)))
+        data2 = synthetic_sources(args.count // 4)
+        inputs.append(("Sources", "synthetic Sources", lambda: io.BytesIO(data2)))
+
+    for name, label, opener in inputs:
+        if name == "Packages":
+            funcs = (("readlines", legacy_packages), ("stream", check.mirror._packages))
+        elif name == "Sources":
+            funcs = (("readlines", legacy_sources), ("stream", check.mirror._sources))
+        else:
+            print("{}: not a catalog".format(label), file=sys.stderr)
+            continue
+
+        print(label)
+        results = []
+        for impl, func in funcs:
+            nb, t, peak, rows = _measure(func, opener, label)
+            results.append(rows)
+            print(
+                "  {:10} {:8} entries {:8.3f} s {:10.0f} entries/s  peak {:8.1f} MiB".format(
+                    impl, nb, t, nb / t if t > 0 else 0, peak / 1048576
+                )
+            )
+        if results[0] != results[1]:
+            print("  MISMATCH between implementations", file=sys.stderr)
+
+
+class _writer:
+    """
+        écrit un catalogue dans plusieurs variantes compressées à la fois
+    """
+
+    openers = {
+        ".gz": lambda f: gzip.open(f, "wb", compresslevel=6),
+        ".xz": lambda f: lzma.open(f, "wb"),
+    }
+
+    def __init__(self, base, compress):
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        self.files = [base + ext for ext in compress]
+        self.streams = [_writer.openers[ext](base + ext) for ext in compress]
+
+    def write(self, data):
+        for f in self.streams:
+            f.write(data)
+
+    def close(self):
+        for f in self.streams:
+            f.close()
+        return self.files
+
+
+def generate(
+    root,
+    suites=2,
+    archs=2,
+    packages=1000,
+    compress=(".gz", ".xz"),
+    churn=0.2,
+    missing=0.05,
+    excess=0.01,
+    pool_mode="sparse",
+    seed=1,
+):
+    """
+    crée une arborescence dists/ + pool/ synthétique
+    @param suites nombre de distributions (suite0, suite1...)
+    @param archs nombre d'architectures par distribution
+    @param packages nombre de paquets binaires par architecture (et packages/4 paquets source)
+    @param churn proportion des paquets dont la version change d'une distribution à l'autre
+    @param missing proportion des fichiers listés absents du pool
+    @param excess proportion de fichiers du pool listés nulle part
+    @param pool_mode sparse: fichiers creux de la bonne taille, empty: fichiers vides
+        (les catalogues annoncent alors une taille nulle), none: pas de fichiers
+    retourne le nombre d'entrées des catalogues
+    """
+    rnd = random.Random(seed)
+    arch_names = ["amd64", "i386", "arm64", "armhf", "ppc64el", "s390x", "mips64el", "riscv64"]
+    arch_names = arch_names[:archs] + ["arch{}".format(i) for i in range(archs - len(arch_names))]
+
+    pool = dict()
+    entries = 0
+
+    def size():
+        return 0 if pool_mode == "empty" else rnd.randint(1000, 100000)
+
+    def fake_hash(name, n):
+        return hashlib.sha256(name.encode()).hexdigest()[:n]
+
+    for k in range(suites):
+        suite = "suite{}".format(k)
+        dists = os.path.join(root, "dists", suite)
+
+        for arch in arch_names:
+            w = _writer(os.path.join(dists, "main", "binary-" + arch, "Packages"), compress)
+            for i in range(packages):
+                name = "{}pkg{}".format(chr(97 + i % 26), i)
+                version = k if rnd.random() < churn else 0
+                filename = "pool/main/{}/{}/{}_1.{}_{}.deb".format(
+                    name[0], name, name, version, arch
+                )
+                if filename not in pool:
+                    pool[filename] = size()
+                w.write(
+                    (
+                        "Package: {name}\nVersion: 1.{version}\nArchitecture: {arch}\n"
+                        "Description: synthetic package\n a synthetic package\n"
+                        "Filename: {filename}\nSize: {size}\nMD5sum: {md5}\nSHA256: {sha256}\n\n"
+                    )
+                    .format(
+                        name=name,
+                        version=version,
+                        arch=arch,
+                        filename=filename,
+                        size=pool[filename],
+                        md5=fake_hash(filename, 32),
+                        sha256=fake_hash(filename, 64),
+                    )
+                    .encode()
+                )
+                entries += 1
+            w.close()
+
+        w = _writer(os.path.join(dists, "main", "source", "Sources"), compress)
+        for i in range(packages // 4):
+            name = "{}src{}".format(chr(97 + i % 26), i)
+            version = k if rnd.random() < churn else 0
+            directory = "pool/main/{}/{}".format(name[0], name)
+            lines = []
+            for ext in ("dsc", "orig.tar.xz", "debian.tar.xz"):
+                filename = "{}/{}_1.{}.{}".format(directory, name, version, ext)
+                if filename not in pool:
+                    pool[filename] = size()
+                lines.append(
+                    " {} {} {}".format(
+                        fake_hash(filename, 64), pool[filename], os.path.basename(filename)
+                    )
+                )
+                entries += 1
+            w.write(
+                "Package: {}\nDirectory: {}\nChecksums-Sha256:\n{}\n\n".format(
+                    name, directory, "\n".join(lines)
+                ).encode()
+            )
+        w.close()
+
+        # fichier Release
+        lines = []
+        for dirpath, dirnames, filenames in os.walk(dists):
+            for i in sorted(filenames):
+                filename = os.path.join(dirpath, i)
+                with open(filename, "rb") as f:
+                    data = f.read()
+                lines.append(
+                    " {} {} {}".format(
+                        hashlib.sha256(data).hexdigest(),
+                        len(data),
+                        os.path.relpath(filename, dists),
+                    )
+                )
+        with open(os.path.join(dists, "Release"), "w") as f:
+            f.write(
+                "Suite: {}\nCodename: {}\nSHA256:\n{}\n".format(suite, suite, "\n".join(lines))
+            )
+
+    if pool_mode != "none":
+        files = [(i, n) for i, n in pool.items() if rnd.random() >= missing]
+        files += [
+            ("pool/main/z/zexcess{}/zexcess{}.deb".format(i, i), size())
+            for i in range(int(len(pool) * excess))
+        ]
+        for filename, n in files:
+            filename = os.path.join(root, filename)
+            try:
+                f = open(filename, "wb")
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                f = open(filename, "wb")
+            with f:
+                if n > 0:
+                    f.truncate(n)
+
+    return entries
+
+
+def bench_generate(args):
+    """
+    crée un miroir synthétique
+    """
+    t = time.perf_counter()
+    entries = generate(
+        args.root,
+        args.suites,
+        args.archs,
+        args.packages,
+        args.compress,
+        args.churn,
+        args.missing,
+        args.excess,
+        args.pool_mode,
+        args.seed,
+    )
+    print("{}: {} entries in {:.1f} s".format(args.root, entries, time.perf_counter() - t))
+
+
+def bench_mirror(args):
+    """
+    mesure les phases de check.py sur des miroirs synthétiques de tailles croissantes
+    """
+    check.verbosity = args.verbose
+
+    for scale in args.scales:
+        # entrées par paquet: une par architecture et par distribution, plus les sources
+        packages = max(1, int(scale / (args.suites * (args.archs + 3 / 4))))
+
+        root = tempfile.mkdtemp(prefix="bench-{}-".format(scale), dir=args.dir)
+        try:
+            t = time.perf_counter()
+            entries = generate(
+                root, args.suites, args.archs, packages, args.compress, pool_mode=args.pool_mode
+            )
+            print(
+                "scale {}: {} entries generated in {:.1f} s".format(
+                    scale, entries, time.perf_counter() - t
+                )
+            )
+
+            check.timer.phases = []
+            out = sys.stdout if args.verbose else io.StringIO()
+            with contextlib.redirect_stdout(out):
+                m = check.mirror(os.path.join(root, ".tmp"), args.db_profile)
+                path = os.path.join(root, "dists")
+
+                with check.timer("parse") as t:
+                    m.parse_files(list(m.walk_dists(path)), args.parse_jobs)
+                    t.rows = m.rows
+                with check.timer("set_pool") as t:
+                    m.set_pool(root, True, args.scan_threads)
+                    t.rows = len(m.pool_files)
+                with check.timer("find_missing") as t:
+                    t.counters["missing"] = m.find_missing()
+                with check.timer("find_excess") as t:
+                    m.find_excess()
+                    t.counters["excess"] = m.excess
+                with check.timer("wget") as t:
+                    m.wget("http://localhost/debian/", 10)
+                    t.rows = len(m.urls)
+                m.db.close()
+
+            check.timer.summary(sys.stdout)
+            if args.metrics:
+                check.timer.write(args.metrics, "scale-{}".format(scale))
+            print()
+
+        finally:
+            if not args.keep:
+                shutil.rmtree(root)
+
+
+class _throttled_handler(http.server.BaseHTTPRequestHandler):
+    """
+    serveur HTTP de test: /pool/<n>.deb renvoie <size> octets, avec un débit total limité
+    et une latence qui augmente quand les requêtes simultanées dépassent la capacité
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        name = os.path.basename(self.path)
+        if not name.endswith(".deb"):
+            self.send_error(404)
+            return
+        size = server.size
+
+        with server.lock:
+            server.active += 1
+            active = server.active
+        try:
+            time.sleep(server.latency * (1 + max(0, active - server.capacity)))
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            block = b"\0" * 65536
+            sent = 0
+            while sent < size:
+                n = min(len(block), size - sent)
+                server.uplink.consume(n)
+                self.wfile.write(block[:n])
+                sent += n
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_download(args):
+    """
+    mesure le téléchargeur et son ordonnanceur contre un serveur local bridé
+    """
+    check.verbosity = args.verbose
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _throttled_handler)
+    server.daemon_threads = True
+    server.size = args.size
+    server.latency = args.latency
+    server.capacity = args.capacity
+    server.uplink = check.throttle(args.uplink)
+    server.lock = threading.Lock()
+    server.active = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/pool/".format(server.server_address[1])
+
+    root = tempfile.mkdtemp(prefix="bench-download-", dir=args.dir)
+    try:
+        work = [
+            (url + "{}.deb".format(i), os.path.join(root, "{}.deb".format(i)), args.size)
+            for i in range(args.files)
+        ]
+        sched = check.scheduler(
+            args.jobs, args.rate, args.host_rate, args.disk_writers, adaptive=args.adaptive
+        )
+        d = check.downloader(args.jobs, args.jobs, 0, sched=sched)
+
+        t = time.perf_counter()
+        failed = d.run(work)
+        elapsed = time.perf_counter() - t
+
+        print(
+            "{} file(s), {} failed, {} byte(s) in {:.2f} s: {:.2f} MB/s".format(
+                len(work), len(failed), d.bytes, elapsed, d.bytes / elapsed / 1e6
+            )
+        )
+        if args.adaptive:
+            print("concurrency: {}".format(" ".join(str(i) for i in sched.history)))
+    finally:
+        server.shutdown()
+        shutil.rmtree(root)
+
+
+def main(args=None):
+    """
+    fonction principale
+    """
+    parser = argparse.ArgumentParser(description="mesures de performance de check.py")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    p = sub.add_parser("parser", help="compare les analyseurs de catalogues")
+    p.add_argument("-n", "--count", type=int, default=50000, help="nombre de paquets synthétiques")
+    p.add_argument("files", nargs="*", help="fichiers Packages ou Sources à mesurer")
+    p.set_defaults(func=bench_parser)
+
+    def add_mirror_arguments(p):
+        p.add_argument("--suites", type=int, default=2, help="nombre de distributions")
+        p.add_argument("--archs", type=int, default=2, help="nombre d'architectures")
+        p.add_argument(
+            "--compress",
+            type=lambda s: ["." + i for i in s.split(",")],
+            default=[".gz", ".xz"],
+            help="variantes des catalogues (gz,xz)",
+        )
+        p.add_argument(
+            "--pool-mode",
+            choices=["sparse", "empty", "none"],
+            default="sparse",
+            help="fichiers creux de la bonne taille, vides ou absents",
+        )
+
+    p = sub.add_parser("generate", help="crée un miroir synthétique")
+    p.add_argument("root", help="répertoire du miroir")
+    add_mirror_arguments(p)
+    p.add_argument("-n", "--packages", type=int, default=1000, help="paquets par architecture")
+    p.add_argument("--churn", type=float, default=0.2, help="proportion de versions différentes")
+    p.add_argument("--missing", type=float, default=0.05, help="proportion de fichiers absents")
+    p.add_argument("--excess", type=float, default=0.01, help="proportion de fichiers en trop")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=bench_generate)
+
+    p = sub.add_parser("mirror", help="mesure les phases de check.py sur des miroirs synthétiques")
+    add_mirror_arguments(p)
+    p.add_argument(
+        "--scales",
+        type=lambda s: [int(i) for i in s.split(",")],
+        default=[10000, 100000, 1000000],
+        help="nombres d'entrées des catalogues",
+    )
+    p.add_argument("--dir", help="répertoire des miroirs temporaires")
+    p.add_argument("--keep", action="store_true", help="garde les miroirs générés")
+    p.add_argument("--db-profile", choices=sorted(check.mirror.profiles), default="default")
+    p.add_argument("--parse-jobs", type=int, default=1)
+    p.add_argument("--scan-threads", type=int, default=1)
+    p.add_argument("--metrics", help="fichier des mesures (lignes JSON)")
+    p.add_argument("-v", "--verbose", action="count", default=0)
+    p.set_defaults(func=bench_mirror)
+
+    p = sub.add_parser("download", help="mesure les téléchargements contre un serveur bridé")
+    p.add_argument("-n", "--files", type=int, default=200, help="nombre de fichiers")
+    p.add_argument("--size", type=check.parse_rate, default=262144, help="taille des fichiers")
+    p.add_argument("--uplink", type=check.parse_rate, default=None, help="débit du serveur")
+    p.add_argument("--latency", type=float, default=0.02, help="latence du serveur (s)")
+    p.add_argument(
+        "--capacity", type=int, default=8, help="requêtes simultanées sans latence ajoutée"
+    )
+    p.add_argument("-j", "--jobs", type=int, default=10)
+    p.add_argument("--rate", type=check.parse_rate, help="débit maximal du client")
+    p.add_argument("--host-rate", type=check.parse_rate, help="débit maximal par hôte")
+    p.add_argument("--disk-writers", type=int, help="écritures disque simultanées")
+    p.add_argument("--adaptive", action="store_true", help="concurrence adaptative")
+    p.add_argument("--dir", help="répertoire des fichiers téléchargés")
+    p.add_argument("-v", "--verbose", action="count", default=0)
+    p.set_defaults(func=bench_download)
+
+    args = parser.parse_args(args=args)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,12 @@ import sys
 import os
 import stat
 import functools
+import itertools
+import contextlib
+import concurrent.futures
 import posixpath
 import glob
+import re
 import argparse
 import urllib.parse
 import tempfile
@@ -14,15 +18,44 @@ import codecs
 import gzip
 import sqlite3
 import json
+import select
+import struct
+import ctypes
+import ctypes.util
+import http.server
+import cProfile
+import hashlib
+import heapq
+import threading
+import http.client
+import queue
+import array
+import bisect
+import mmap
+import fcntl
+import signal
 import time
 
 
-# # lzma n'est pas toujours présent
-# try:
-#     import lzma
-# except ImportError:
-#     lzma = None
-#     pass
+# resource n'existe que sous Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+    pass
+
+# lzma et bz2 ne sont pas toujours présents
+try:
+    import lzma
+except ImportError:
+    lzma = None
+    pass
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+    pass
 
 # python 3 est requis
 if sys.version_info.major < 3:
@@ -67,13 +100,519 @@ def debug(level: int, *args):
         sys.stderr.write("\n")
 
 
+class timer:
+    """
+        mesure une phase: durée, temps CPU (processus fils compris), pic de mémoire,
+        compteurs (rows, files, bytes...), et le débit en lignes par seconde si renseigné
+        les mesures sont conservées dans timer.phases
+        si timer.profile_dir est renseigné, chaque phase est profilée avec cProfile
+    """
+
+    phases = []
+    profile_dir = None
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.counters = dict()
+
+    def _cpu_time():
+        t = time.process_time()
+        if resource is not None:
+            r = resource.getrusage(resource.RUSAGE_CHILDREN)
+            t += r.ru_utime + r.ru_stime
+        return t
+
+    def _max_rss():
+        """
+        pic de mémoire du processus, en Mio (ru_maxrss est en Kio sous Linux)
+        """
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def __enter__(self):
+        self.profiler = None
+        if timer.profile_dir is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        self.cpu = timer._cpu_time()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        cpu = timer._cpu_time() - self.cpu
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(timer.profile_dir, exist_ok=True)
+            self.profiler.dump_stats(os.path.join(timer.profile_dir, self.name + ".prof"))
+
+        record = {"phase": self.name, "wall": round(elapsed, 6), "cpu": round(cpu, 6)}
+        record["max_rss_mb"] = timer._max_rss()
+        if self.rows is not None:
+            record["rows"] = self.rows
+            record["rows_per_s"] = round(self.rows / elapsed) if elapsed > 0 else None
+        record.update(self.counters)
+        timer.phases.append(record)
+
+        if self.rows is None:
+            debug(1, "{}: {:.3f} s".format(self.name, elapsed))
+        else:
+            debug(
+                1,
+                "{}: {:.3f} s, {} row(s), {:.0f} rows/s".format(
+                    self.name, elapsed, self.rows, self.rows / elapsed if elapsed > 0 else 0
+                ),
+            )
+
+    def summary(file=sys.stderr):
+        """
+        affiche le tableau des phases mesurées
+        """
+        counters = []
+        for record in timer.phases:
+            for key in record:
+                if key not in ("phase", "wall", "cpu", "max_rss_mb") and key not in counters:
+                    counters.append(key)
+
+        header = ["phase", "wall (s)", "cpu (s)", "rss (MiB)"] + counters
+        lines = [header]
+        for record in timer.phases:
+            line = [
+                record["phase"],
+                "{:.3f}".format(record["wall"]),
+                "{:.3f}".format(record["cpu"]),
+                "" if record["max_rss_mb"] is None else "{:.1f}".format(record["max_rss_mb"]),
+            ]
+            line += ["" if record.get(i) is None else str(record.get(i)) for i in counters]
+            lines.append(line)
+
+        widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+        for line in lines:
+            print(
+                "  ".join(
+                    i.ljust(w) if k == 0 else i.rjust(w)
+                    for k, (i, w) in enumerate(zip(line, widths))
+                ),
+                file=file,
+            )
+
+    def write(filename, run):
+        """
+        ajoute les mesures au fichier filename, une ligne JSON par phase
+        """
+        with open(filename, "a") as f:
+            for record in timer.phases:
+                f.write(json.dumps(dict(run=run, **record)))
+                f.write("\n")
+
+
+class dists_filter:
+    """
+        filtre des architectures et des sections de l'arborescence dists,
+        compilé en une seule expression régulière
+    """
+
+    architectures = [
+        "alpha",
+        "amd64",
+        "arm64",
+        "armel",
+        "armhf",
+        "hppa",
+        "hurd-amd64",
+        "hurd-i386",
+        "i386",
+        "ia64",
+        "kfreebsd-amd64",
+        "kfreebsd-i386",
+        "loong64",
+        "m68k",
+        "mips",
+        "mips64el",
+        "mipsel",
+        "powerpc",
+        "ppc64",
+        "ppc64el",
+        "riscv64",
+        "s390x",
+        "sh4",
+        "sparc64",
+        "x32",
+    ]
+
+    # exclues par défaut
+    default_excluded = [
+        "arm64",
+        "armel",
+        "armhf",
+        "hurd-i386",
+        "kfreebsd-amd64",
+        "kfreebsd-i386",
+        "mips",
+        "mips64el",
+        "mipsel",
+        "powerpc",
+        "ppc64el",
+        "s390x",
+    ]
+
+    def __init__(self, archs=None, exclude_archs=None, sections=None):
+        """
+        @param archs architectures à garder (all est toujours gardée), les autres sont exclues
+        @param exclude_archs architectures exclues en plus
+        @param sections sections à garder (main, contrib, non-free...), toutes si None
+        """
+        if archs:
+            excluded = [i for i in dists_filter.architectures if i not in archs and i != "all"]
+        else:
+            excluded = list(dists_filter.default_excluded)
+        for i in exclude_archs or []:
+            if i not in excluded:
+                excluded.append(i)
+
+        patterns = []
+        if excluded:
+            # binary-<arch>, installer-<arch>, Contents-<arch>.gz, Contents-udeb-<arch>.gz...
+            # (le préfixe évite que -i386 exclue hurd-i386)
+            patterns.append(
+                r"(?:binary|installer|Contents(?:-udeb)?)-(?:{})(?=[/.]|$)".format(
+                    "|".join(re.escape(i) for i in sorted(excluded))
+                )
+            )
+        if sections:
+            # le répertoire qui contient binary-*, source, installer-* ou i18n est la section
+            patterns.append(
+                r"(?:^|/)(?!(?:{}|debian-installer)/)[^/]+/(?:debian-installer/)?"
+                r"(?:binary-[^/]+|source|installer-[^/]+|i18n)(?:/|$)".format(
+                    "|".join(re.escape(i) for i in sections)
+                )
+            )
+
+        self.excluded = excluded
+        self.sections = sections
+        self.regex = re.compile("|".join(patterns)) if patterns else None
+        debug(2, "dists filter: {}".format(self.regex.pattern if self.regex else None))
+
+    def unwanted(self, path):
+        return self.regex is not None and self.regex.search(path) is not None
+
+    def load(filename):
+        """
+        lit la configuration du filtre (JSON: arch, exclude-arch, section)
+        """
+        with open(filename, "r") as f:
+            return json.load(f)
+
+
+class pool_index:
+    """
+        index compact des fichiers du pool: tableaux triés des hash 64 bits des chemins
+        et des tailles, au lieu d'un dictionnaire de chaînes (16 octets par fichier)
+        la recherche est dichotomique; les modifications (téléchargements, mode surveillance)
+        sont gardées à part dans un petit dictionnaire
+        les tableaux sont lus depuis la table pool, triée par SQLite,
+        ou projetés en mémoire depuis un fichier annexe, marqué de la version de la table pool
+    """
+
+    MAGIC = b"dlpool2\0"
+    HEADER = struct.Struct("<8sqq")
+
+    def __init__(self, hashes, sizes, buffer=None):
+        self.hashes = hashes
+        self.sizes = sizes
+        self.buffer = buffer
+        self.changes = dict()
+        self.count = len(hashes)
+
+    def key(filename):
+        """
+        hash 64 bits signé d'un chemin, tel que stocké dans la colonne pool.hash
+        (à 500 000 fichiers, la probabilité d'une collision est de l'ordre de 1e-8)
+        """
+        digest = hashlib.blake2b(filename.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little", signed=True)
+
+    def from_db(cur, root):
+        hashes = array.array("q")
+        sizes = array.array("q")
+        cur.execute("select hash,size from pool where root=? order by hash", [root])
+        while True:
+            rows = cur.fetchmany(mirror.batch_size)
+            if not rows:
+                break
+            hashes.extend(row[0] for row in rows)
+            sizes.extend(row[1] for row in rows)
+        return pool_index(hashes, sizes)
+
+    def save(self, filename, version):
+        """
+        écrit le fichier annexe (remplacement atomique), marqué de la version de la table pool
+        """
+        assert not self.changes
+        with open(filename + ".tmp", "wb") as f:
+            f.write(pool_index.HEADER.pack(pool_index.MAGIC, len(self.hashes), version))
+            f.write(self.hashes)
+            f.write(self.sizes)
+        os.replace(filename + ".tmp", filename)
+
+    def load(filename, version):
+        """
+        projette le fichier annexe en mémoire, None s'il est absent
+        ou ne correspond pas à la version de la table pool
+        """
+        try:
+            with open(filename, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        size = pool_index.HEADER.size
+        magic, n, v = pool_index.HEADER.unpack_from(buffer)
+        if magic != pool_index.MAGIC or v != version or len(buffer) != size + 16 * n:
+            buffer.close()
+            return None
+        view = memoryview(buffer)
+        hashes = view[size : size + 8 * n].cast("q")
+        sizes = view[size + 8 * n :].cast("q")
+        return pool_index(hashes, sizes, buffer)
+
+    def _lookup(self, key):
+        if key in self.changes:
+            return self.changes[key]
+        i = bisect.bisect_left(self.hashes, key)
+        if i < len(self.hashes) and self.hashes[i] == key:
+            return self.sizes[i]
+        return None
+
+    def get(self, filename, default=None):
+        size = self._lookup(pool_index.key(filename))
+        return default if size is None else size
+
+    def __contains__(self, filename):
+        return self._lookup(pool_index.key(filename)) is not None
+
+    def __len__(self):
+        return self.count
+
+    def __setitem__(self, filename, size):
+        key = pool_index.key(filename)
+        if self._lookup(key) is None:
+            self.count += 1
+        self.changes[key] = size
+
+    def pop(self, filename, default=None):
+        key = pool_index.key(filename)
+        size = self._lookup(key)
+        if size is None:
+            return default
+        self.changes[key] = None
+        self.count -= 1
+        return size
+
+
+class lookup_index:
+    """
+        index des fichiers d'une archive pour les serveurs frontaux: présence, taille et hash
+        d'un chemin, sans connexion SQLite; fichier projeté en mémoire:
+        en-tête, chemins UTF-8 triés mis bout à bout, positions des chemins, enregistrements
+        la recherche est dichotomique sur les chemins
+    """
+
+    MAGIC = b"dllook1\0"
+    HEADER = struct.Struct("<8sqqd")
+    # taille attendue (-1 si non listé), taille dans le pool (-1 si absent), hash binaire
+    RECORD = struct.Struct("<qqB32s")
+
+    def __init__(self, buffer, count, strings, timestamp):
+        self.buffer = buffer
+        self.count = count
+        self.timestamp = timestamp
+        start = lookup_index.HEADER.size
+        self.strings = start
+        view = memoryview(buffer)
+        self.offsets = view[start + strings : start + strings + 8 * (count + 1)].cast("q")
+        self.records = start + strings + 8 * (count + 1)
+
+    def write(filename, rows, timestamp):
+        """
+        écrit l'index (remplacement atomique)
+        @param rows (chemin, taille attendue, taille dans le pool, hash hexadécimal),
+                    triés par chemin
+        """
+        offsets = array.array("q", [0])
+        records = bytearray()
+        with open(filename + ".tmp", "wb") as f:
+            f.write(bytes(lookup_index.HEADER.size))
+            for path, size, pool_size, digest in rows:
+                path = path.encode("utf-8")
+                f.write(path)
+                offsets.append(offsets[-1] + len(path))
+                try:
+                    digest = bytes.fromhex(digest or "")[:32]
+                except ValueError:
+                    digest = b""
+                records += lookup_index.RECORD.pack(size, pool_size, len(digest), digest)
+            f.write(offsets)
+            f.write(records)
+            f.seek(0)
+            f.write(
+                lookup_index.HEADER.pack(
+                    lookup_index.MAGIC, len(offsets) - 1, offsets[-1], timestamp
+                )
+            )
+        os.replace(filename + ".tmp", filename)
+        return len(offsets) - 1
+
+    def load(filename):
+        """
+        projette l'index en mémoire, None s'il est absent ou invalide
+        """
+        try:
+            with open(filename, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        header = lookup_index.HEADER
+        if len(buffer) < header.size:
+            buffer.close()
+            return None
+        magic, n, strings, timestamp = header.unpack_from(buffer)
+        size = header.size + strings + 8 * (n + 1) + lookup_index.RECORD.size * n
+        if magic != lookup_index.MAGIC or len(buffer) != size:
+            buffer.close()
+            return None
+        return lookup_index(buffer, n, strings, timestamp)
+
+    def close(self):
+        self.offsets.release()
+        self.buffer.close()
+
+    def _path(self, i):
+        return self.buffer[self.strings + self.offsets[i] : self.strings + self.offsets[i + 1]]
+
+    def _find(self, filename):
+        key = filename.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._path(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._path(lo) == key:
+            return lo
+        return -1
+
+    def lookup(self, filename):
+        """
+        retourne None pour un chemin inconnu, sinon (présent, taille, hash):
+        présent si le fichier est dans le pool avec la taille attendue,
+        hash None pour un fichier du pool listé par aucun catalogue (en trop)
+        """
+        i = self._find(filename)
+        if i < 0:
+            return None
+        size, pool_size, n, digest = lookup_index.RECORD.unpack_from(
+            self.buffer, self.records + i * lookup_index.RECORD.size
+        )
+        if size < 0:
+            return (True, pool_size, None)
+        return (pool_size == size, size, digest[:n].hex())
+
+    def __contains__(self, filename):
+        return self._find(filename) >= 0
+
+    def __len__(self):
+        return self.count
+
+
 class mirror:
-    def __init__(self, tmp_dir=".tmp"):
+
+    # nombre de lignes par executemany
+    batch_size = 10000
+
+    # nombre de répertoires relus entre deux validations du scan du pool
+    checkpoint_dirs = 1000
+
+    # délai maximal entre deux validations des hash calculés (secondes)
+    commit_interval = 5.0
+
+    # profils d'écriture de la base: pragmas, et index reconstruits après un chargement massif
+    profiles = {
+        "default": {"pragmas": ["journal_mode=DELETE", "synchronous=FULL"], "defer_indexes": False},
+        "fast": {
+            "pragmas": [
+                "page_size=16384",
+                "journal_mode=WAL",
+                "synchronous=OFF",
+                "cache_size=-262144",
+                "temp_store=MEMORY",
+            ],
+            "defer_indexes": True,
+        },
+    }
+
+    indexes = [
+        "create index if not exists package_fk on package (catalog_id)",
+        "create index if not exists package_file on package (file_id)",
+        "create index if not exists pool_root_filename on pool (root, filename)",
+        "create index if not exists pool_root_hash on pool (root, hash)",
+    ]
+
+    def __init__(
+        self, tmp_dir=".tmp", profile="default", selection=None, archive=None, db_dir=None
+    ):
+        """
+        @param archive racine de l'archive dont les catalogues sont lus (clé des catalogues)
+        @param db_dir répertoire de mirror.db, partagé par les archives (tmp_dir par défaut)
+        """
+        self.archive = archive
+        self.scanned = False
+        self._pool_files = None
         self.active_catalog = []
+        self.selection = selection or dists_filter()
+        self.releases = dict()
+        self.rows = 0
+        self.stats = dict()
         self._set_tmp_dir(tmp_dir)
 
-        self.db = sqlite3.connect(os.path.join(self.tmp_dir, "mirror.db"))
-        self.marker = os.path.join(self.tmp_dir, "pools.json")
+        # plusieurs processus peuvent écrire dans la base: on attend le verrou
+        self.db_dir = db_dir or self.tmp_dir
+        # base partagée avec des archives vérifiées en parallèle
+        self.shared_db = db_dir is not None
+        self.db = sqlite3.connect(os.path.join(self.db_dir, "mirror.db"), timeout=600)
+        self.marker = os.path.join(self.db_dir, "pools.json")
+
+        self.profile = mirror.profiles[profile]
+        for pragma in self.profile["pragmas"]:
+            self.db.execute("pragma " + pragma)
+        debug(1, "db profile {}".format(profile))
+
+        # bases créées par une version précédente: table package non normalisée
+        columns = [row[1] for row in self.db.execute("pragma table_info(package)")]
+        migrate = "filename" in columns
+        if migrate:
+            debug(1, "migrating package table")
+            self.db.execute("drop index if exists catalog_fk")
+            self.db.execute("drop index if exists package_fk")
+            self.db.execute("alter table package rename to package_old")
+
+        # pool d'une version précédente: un seul pool, sans clé
+        columns = [row[1] for row in self.db.execute("pragma table_info(pool)")]
+        if columns and "root" not in columns:
+            debug(1, "migrating pool tables")
+            self.db.execute("drop index if exists pool_filename")
+            self.db.execute("drop index if exists pool_hash")
+            self.db.execute("drop table if exists pool_dir")
+            self.db.execute("alter table pool rename to pool_old")
+
+        # cache des hash d'une version précédente: sans racine du pool
+        columns = [row[1] for row in self.db.execute("pragma table_info(digest)")]
+        if columns and "root" not in columns:
+            debug(1, "migrating digest table")
+            self.db.execute("alter table digest rename to digest_old")
 
         self.db.executescript("""\
 
@@ -83,31 +622,132 @@ create table if not exists catalog (
     timestamp   datetime,
     size        integer,
     done        boolean,
-    count       integer
+    count       integer,
+    sha256      text,
+    replaced    integer,
+    root        text
+);
+
+create table if not exists generation (
+    generation_id   integer not null primary key autoincrement,
+    timestamp       real not null,
+    root            text
+);
+
+create table if not exists generation_catalog (
+    generation_id   integer not null,
+    catalog_id      integer not null,
+    primary key (generation_id, catalog_id)
+);
+
+create table if not exists file (
+    file_id     integer not null primary key,
+    filename    text not null,
+    size        integer not null,
+    hash        text not null,
+    unique (filename, size, hash)
 );
 
 create table if not exists package (
     catalog_id  integer not null,
+    file_id     integer not null
+);
+
+create temp table if not exists staging (
     filename    text not null,
-    size        integer,
-    hash        text
+    size        integer not null,
+    hash        text not null
 );
 
 create table if not exists pool (
+    root        text not null,
     filename    text not null,
-    size        integer not null
+    size        integer not null,
+    hash        integer
 );
 
 create table if not exists pool_scanned (
     filename    text not null,
-    timestamp   datetime not null
+    timestamp   datetime not null,
+    version     integer
 );
 
-create index if not exists catalog_fk on package (filename);
+create table if not exists digest (
+    root        text not null,
+    filename    text not null,
+    algo        text not null,
+    size        integer not null,
+    mtime       real not null,
+    inode       integer not null,
+    hash        text not null,
+    primary key (root, filename, algo)
+);
 
-create index if not exists package_fk on package (catalog_id);
+create table if not exists pool_dir (
+    root        text not null,
+    dirname     text not null,
+    mtime       real not null,
+    primary key (root, dirname)
+);
 
 """)
+        # bases créées par une version précédente
+        columns = [row[1] for row in self.db.execute("pragma table_info(catalog)")]
+        if "sha256" not in columns:
+            self.db.execute("alter table catalog add column sha256 text")
+        if "replaced" not in columns:
+            self.db.execute("alter table catalog add column replaced integer")
+        if "root" not in columns:
+            self.db.execute("alter table catalog add column root text")
+        columns = [row[1] for row in self.db.execute("pragma table_info(pool_scanned)")]
+        if "version" not in columns:
+            self.db.execute("alter table pool_scanned add column version integer")
+        columns = [row[1] for row in self.db.execute("pragma table_info(generation)")]
+        if "root" not in columns:
+            self.db.execute("alter table generation add column root text")
+        if "digest_old" in [row[0] for row in self.db.execute("select name from sqlite_master")]:
+            # les hash ne sont gardés que si un seul pool a été scanné
+            roots = [row[0] for row in self.db.execute("select filename from pool_scanned")]
+            if len(roots) == 1:
+                self.db.execute(
+                    "insert into digest (root,filename,algo,size,mtime,inode,hash)"
+                    " select ?,filename,algo,size,mtime,inode,hash from digest_old",
+                    roots,
+                )
+            self.db.execute("drop table digest_old")
+            self.db.commit()
+        if "pool_old" in [row[0] for row in self.db.execute("select name from sqlite_master")]:
+            roots = [row[0] for row in self.db.execute("select filename from pool_scanned")]
+            if len(roots) == 1:
+                self.db.executemany(
+                    "insert into pool (root,filename,size,hash) values (?,?,?,?)",
+                    [
+                        (roots[0], row[0], row[1], pool_index.key(row[0]))
+                        for row in self.db.execute("select filename,size from pool_old").fetchall()
+                    ],
+                )
+            else:
+                self.db.execute("delete from pool_scanned")
+            self.db.execute("drop table pool_old")
+            self.db.commit()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(self.tmp_dir, "pool.idx"))
+
+        if migrate:
+            self.db.executescript("""\
+insert into staging select filename,coalesce(size,-1),coalesce(hash,'') from package_old;
+insert or ignore into file (filename,size,hash) select filename,size,hash from staging;
+insert into package (catalog_id,file_id)
+    select o.catalog_id,f.file_id from package_old o join file f
+    on f.filename=o.filename and f.size=coalesce(o.size,-1) and f.hash=coalesce(o.hash,'');
+delete from staging;
+drop table package_old;
+""")
+            self.db.commit()
+            self.db.execute("vacuum")
+
+        for sql in mirror.indexes:
+            self.db.execute(sql)
 
     def _set_tmp_dir(self, tmp_dir):
         if tmp_dir is None:
@@ -119,199 +759,500 @@ create index if not exists package_fk on package (catalog_id);
         self.tmp_dir = os.path.abspath(self.tmp_dir)
         debug(1, "tmp-dir %s" % self.tmp_dir)
 
-    def _is_key(a, b):
-        return a.lower().startswith((b + ":").lower())
-
-    def _get_val(a):
-        return a[a.find(":") + 1 :].lstrip()
-
-    def _packages(self, f, inserter, filename):
+    def _stanzas(f, fields):
+        """
+        itère sur les paragraphes deb822 d'un flux binaire, ligne à ligne
+        seuls les champs demandés sont conservés, les valeurs restent en bytes
+        @param f flux ouvert en mode binaire
+        @param fields noms des champs à extraire (bytes, casse canonique)
+        """
+        # correspondance nom de champ lu -> nom canonique ou None,
+        # pour ne pas convertir la casse à chaque ligne
+        names = dict()
+        wanted = dict((i.lower(), i) for i in fields)
+
+        stanza = dict()
+        key = None
+        for line in f:
+            if line[:1] in (b" ", b"\t"):
+                # ligne de continuation
+                if key is not None:
+                    stanza[key] += b"\n" + line.strip()
+            elif line.strip() == b"":
+                if stanza:
+                    yield stanza
+                    stanza = dict()
+                key = None
+            else:
+                i = line.find(b":")
+                name = line[:i]
+                try:
+                    key = names[name]
+                except KeyError:
+                    key = names[name] = wanted.get(name.lower())
+                if key is not None:
+                    stanza[key] = line[i + 1 :].strip()
+        if stanza:
+            yield stanza
+
+    def _packages(f, inserter, filename):
         """
         callback, analyse les fichiers Packages
         """
         debug(1, "Scanning _packages {}".format(filename))
-        filename = ""
-        size = None
-        md5 = None
         nb = 0
 
-        def reset():
-            nonlocal self, filename, size, md5, nb
-            filename = ""
-            size = None
-            md5 = None
-
-        def finish():
-            nonlocal self, filename, size, md5, nb
-            if filename != "":
-                inserter(filename, size, md5)
+        for stanza in mirror._stanzas(f, (b"Filename", b"Size", b"MD5sum", b"SHA256")):
+            filename = stanza.get(b"Filename")
+            if filename:
+                size = stanza.get(b"Size")
+                md5 = stanza.get(b"MD5sum") or stanza.get(b"SHA256")
+                inserter(
+                    filename.decode("utf-8"),
+                    int(size) if size is not None else None,
+                    md5.decode("ascii") if md5 is not None else None,
+                )
                 nb += 1
 
-        for i in f.readlines():
-            i = i.decode("utf-8").rstrip()
-            if i == "":
-                finish()
-                reset()
-            elif mirror._is_key(i, "Filename"):
-                filename = mirror._get_val(i)
-            elif mirror._is_key(i, "Size"):
-                size = int(mirror._get_val(i))
-            elif mirror._is_key(i, "MD5sum"):
-                md5 = mirror._get_val(i)
-
-        finish()
         return nb
 
-    def _sources(self, f, inserter, filename):
+    def _sources(f, inserter, filename):
         """
         callback, analyse les fichiers Sources
         """
         debug(1, "Scanning _sources {}".format(filename))
-        in_files = False
-        directory = ""
-        files = []
         nb = 0
 
-        def reset():
-            nonlocal self, in_files, directory, files, nb
-            in_files = False
-            directory = ""
-            files = []
-
-        def finish():
-            nonlocal self, in_files, directory, files, nb
-            if directory != "":
-                for i in files:
-                    inserter(os.path.join(directory, i[0]), int(i[1]), i[2])
-                    nb += 1
-
-        for i in f.readlines():
-            i = i.decode("utf-8").rstrip()
-            if i == "":
-                finish()
-                reset()
-            if in_files:
-                if i[0] == " " or i[0] == "\t":
-                    i = i.lstrip().split(" ")
-                    files.append((i[2], i[1], i[0]))  # name size md5/sha256
-                else:
-                    in_files = False
-            if i == "Checksums-Sha256:":  # la section Files: contient la liste avec hash md5. dépréciée?
-                in_files = True
-            elif i[0:10] == "Directory:":
-                directory = i[10:].lstrip()
+        # la section Files: contient la liste avec hash md5. dépréciée?
+        for stanza in mirror._stanzas(f, (b"Directory", b"Checksums-Sha256")):
+            directory = stanza.get(b"Directory")
+            if directory:
+                directory = directory.decode("utf-8")
+                for i in stanza.get(b"Checksums-Sha256", b"").split(b"\n"):
+                    i = i.split()
+                    if len(i) == 3:  # sha256 size name
+                        inserter(
+                            os.path.join(directory, i[2].decode("utf-8")),
+                            int(i[1]),
+                            i[0].decode("ascii"),
+                        )
+                        nb += 1
 
-        finish()
         return nb
 
     def _unwanted(self, filename):
-        if filename.find("-armhf") != -1:
-            return True
-        if filename.find("-armel") != -1:
-            return True
-        if filename.find("-arm64") != -1:
-            return True
-        if filename.find("-hurd-i386") != -1:
-            return True
-        if filename.find("-kfreebsd") != -1:
-            return True  # -kfreebsd-amd64 -kfreebsd-i386
-        if filename.find("-mips") != -1:
-            return True  # -mips -mips64el -mipsel
-        if filename.find("-powerpc") != -1:
-            return True
-        if filename.find("-ppc64el") != -1:
-            return True
-        if filename.find("-s390x") != -1:
-            return True
-        return False
+        return self.selection.unwanted(filename)
 
-    def parse(self, filename, path):
+    def _is_catalog(relpath):
         """
-        lit un fichier ou une arborescence de fichiers Packages et Sources
+        indique si un chemin suit la structure <section>/binary-<arch>/Packages*
+        ou <section>/source/Sources*
+        """
+        parts = relpath.split("/")
+        if len(parts) < 2:
+            return False
+        name = os.path.splitext(parts[-1])[0]
+        return (name == "Packages" and parts[-2].startswith("binary-")) or (
+            name == "Sources" and parts[-2] == "source"
+        )
+
+    def walk_dists(self, path):
         """
+        cherche les catalogues d'une arborescence dists
+        dans un répertoire qui a un fichier InRelease ou Release, seuls les index qu'il liste
+        sont examinés; sinon le parcours ne descend pas dans les répertoires qui ne peuvent pas
+        contenir de catalogue, ni dans ceux exclus par le filtre
+        retourne des couples (filename, path), self.visited compte les fichiers examinés
+        """
+        self.visited = 0
+
+        # répertoires sans catalogues
+        skipped = ("i18n", "dep11", "by-hash")
 
+        for e in os.scandir(path):
+            if not e.is_dir(follow_symlinks=False):
+                continue
+            debug(2, "analyzing dir: " + e.path)
+            for root, dirs, files in os.walk(e.path, followlinks=True):
+                rel = os.path.relpath(root, path)
+
+                hashes = self._release(root)
+                if hashes is not None:
+                    dirs[:] = []
+                    for i in sorted(hashes):
+                        if mirror._is_catalog(i) and not self._unwanted(os.path.join(rel, i)):
+                            filename = os.path.join(root, i)
+                            self.visited += 1
+                            if os.path.isfile(filename):
+                                yield filename, path
+                    continue
+
+                dirs[:] = [
+                    i
+                    for i in dirs
+                    if i not in skipped
+                    and not i.startswith("installer-")
+                    and not self._unwanted(os.path.join(rel, i))
+                ]
+                for i in files:
+                    self.visited += 1
+                    if mirror._is_catalog(os.path.join(rel, i)):
+                        yield os.path.join(root, i), path
+
+    def _catalog_kind(filename):
+        """
+        retourne le module de décompression et la fonction d'analyse d'un catalogue
+        """
         mod = None
         func = None
 
         name, ext = os.path.splitext(os.path.basename(filename))
 
         if name == "Packages":
-            func = self._packages
+            func = mirror._packages
         elif name == "Sources":
-            func = self._sources
+            func = mirror._sources
 
         if ext == ".gz":
             mod = gzip
-        # elif ext == ".xz":
-        #     mod = lzma
+        elif ext == ".xz":
+            mod = lzma
+        elif ext == ".bz2":
+            mod = bz2
         elif ext == "":
             mod = codecs
 
-        if mod and func:
-            orig = os.path.relpath(filename, path)
-            with mod.open(filename, "rb") as f:
-                if len(f.peek(1)) > 0:
+        return mod, func
+
+    def _select_catalogs(catalogs):
+        """
+        ne garde qu'une variante de chaque catalogue (Packages, Packages.gz, Packages.xz...):
+        la moins coûteuse à décompresser parmi celles présentes et lisibles
+        """
+        # ordre de préférence: décompression la plus rapide d'abord
+        cost = {"": 0, ".gz": 1, ".xz": 2, ".bz2": 3}
 
-                    if self._unwanted(filename):
-                        debug(1, "File ignored: {}".format(orig))
-                        return
+        selected = dict()
+        for filename, path in catalogs:
+            mod, func = mirror._catalog_kind(filename)
+            if mod is None or func is None:
+                continue
+            base, ext = os.path.splitext(filename)
+            if ext == "" and os.path.getsize(filename) == 0:
+                continue
+            other = selected.get(base)
+            if other is None or cost[ext] < cost[os.path.splitext(other[0])[1]]:
+                selected[base] = (filename, path)
 
-                    st = os.stat(filename)
+        result = []
+        for base in sorted(selected):
+            debug(2, "catalog {}".format(selected[base][0]))
+            result.append(selected[base])
+        return result
 
-                    cur = self.db.cursor()
-                    cur.execute(
-                        "select catalog_id,timestamp,size,done from catalog where filename=?",
-                        [filename],
-                    )
+    def _release(self, dirname):
+        """
+        retourne les SHA256 des index listés dans le fichier InRelease ou Release d'un répertoire
+        (dictionnaire chemin relatif -> hash), None s'il n'y en a pas
+        les Release des composants (main/binary-amd64/Release...) ne listent pas d'index:
+        ils sont ignorés
+        """
+        if dirname in self.releases:
+            return self.releases[dirname]
+
+        hashes = None
+        for name in ("InRelease", "Release"):
+            filename = os.path.join(dirname, name)
+            if os.path.isfile(filename):
+                hashes = dict()
+                with open(filename, "rb") as f:
+                    # dans InRelease, la signature ne contient pas de champ SHA256
+                    for stanza in mirror._stanzas(f, (b"SHA256",)):
+                        for i in stanza.get(b"SHA256", b"").split(b"\n"):
+                            i = i.split()
+                            if len(i) == 3:  # sha256 size name
+                                hashes[i[2].decode("utf-8")] = i[0].decode("ascii")
+                debug(2, "{}: {} index(es)".format(filename, len(hashes)))
+                if hashes:
+                    break
+                hashes = None
+
+        self.releases[dirname] = hashes
+        return hashes
+
+    def _release_hash(self, filename, path):
+        """
+        retourne le SHA256 d'un catalogue d'après le Release de sa distribution, ou None
+        remonte jusqu'au premier Release qui liste le catalogue
+        """
+        dirname = os.path.dirname(filename)
+        while True:
+            hashes = self._release(dirname)
+            if hashes is not None and os.path.relpath(filename, dirname) in hashes:
+                return hashes[os.path.relpath(filename, dirname)]
+            if len(dirname) <= len(path) or dirname == os.path.dirname(dirname):
+                return None
+            dirname = os.path.dirname(dirname)
+
+    def _pending(self, filename, path):
+        """
+        indique si un catalogue doit être (re)lu
+        retourne le couple (stat, sha256) si c'est le cas, None sinon
 
-                    row = cur.fetchone()
+        le cache est indexé par le SHA256 donné par le fichier Release: un catalogue
+        inchangé n'est pas ouvert, même si sa date de modification a changé.
+        à défaut de Release, la date et la taille du fichier sont comparées.
+        """
+        mod, func = mirror._catalog_kind(filename)
+        if mod is None or func is None:
+            return None
 
-                    if row is not None and (
-                        row[1] == st.st_mtime and row[2] == st.st_size and row[3] == 1
-                    ):
-                        # print("File {} already parsed".format(orig))
-                        self.active_catalog.append(row[0])
+        orig = os.path.relpath(filename, path)
 
-                    else:
-                        if row is not None:
-                            cur.execute("delete from catalog where catalog_id=?", [row[0]])
-                            cur.execute("delete from package where catalog_id=?", [row[0]])
+        if self._unwanted(orig):
+            debug(1, "File ignored: {}".format(orig))
+            return None
 
-                        cur.execute(
-                            "insert into catalog (filename,timestamp,size,done) values (?,?,?,?)",
-                            (filename, st.st_mtime, st.st_size, 0),
-                        )
-                        catalog_id = cur.lastrowid
-
-                        # debug(2, "new catalog_id: " + str(catalog_id))
-                        # sys.stdout.write("Reading {} …".format(orig))
-                        # sys.stdout.flush()
-
-                        nb = func(
-                            f,
-                            lambda filename, size, md5: cur.execute(
-                                "insert into package values (?,?,?,?)",
-                                (catalog_id, filename, size, md5),
-                            ),
-                            filename,
-                        )
+        sha256 = self._release_hash(filename, path)
 
-                        # sys.stdout.write(" found {} file(s)\n".format(nb))
-                        debug(1, "{} entries added: {}".format(filename, nb))
+        cur = self.db.cursor()
+        cur.execute(
+            "select catalog_id,timestamp,size,done,sha256 from catalog"
+            " where filename=? and replaced is null",
+            [filename],
+        )
+        row = cur.fetchone()
 
-                        cur.execute(
-                            "update catalog set done=1,count=? where rowid=?", [nb, catalog_id]
-                        )
+        if row is not None and sha256 is not None and row[3] == 1 and row[4] == sha256:
+            # debug(2, "File {} unchanged".format(orig))
+            self.active_catalog.append(row[0])
+            cur.close()
+            return None
+
+        with mod.open(filename, "rb") as f:
+            if len(f.peek(1)) == 0:
+                cur.close()
+                return None
+
+        st = os.stat(filename)
+
+        if row is not None and (
+            row[1] == st.st_mtime
+            and row[2] == st.st_size
+            and row[3] == 1
+            and (row[4] is None or sha256 is None)
+        ):
+            # print("File {} already parsed".format(orig))
+            if sha256 is not None:
+                cur.execute("update catalog set sha256=? where catalog_id=?", [sha256, row[0]])
+            self.active_catalog.append(row[0])
+            st = None
+
+        elif row is not None:
+            self._retire_catalog(cur, row[0])
+
+        cur.close()
+        return None if st is None else (st, sha256)
+
+    def _retire_catalog(self, cur, catalog_id):
+        """
+        retire un catalogue remplacé (contenu changé, ou autre compression choisie)
+        """
+        # un catalogue d'une génération conservée est gardé pour les différences
+        cur.execute("select 1 from generation_catalog where catalog_id=?", [catalog_id])
+        if cur.fetchone() is not None:
+            cur.execute(
+                "update catalog set replaced=? where catalog_id=?", [time.time(), catalog_id]
+            )
+        else:
+            cur.execute("delete from catalog where catalog_id=?", [catalog_id])
+            cur.execute("delete from package where catalog_id=?", [catalog_id])
+
+    def _retire_variants(self, catalogs):
+        """
+        retire les catalogues lus sous une autre compression que celle choisie
+        (Packages.gz lu précédemment, Packages.xz apparu depuis)
+        """
+        cur = self.db.cursor()
+        for filename, path in catalogs:
+            base, ext = os.path.splitext(filename)
+            others = [base + i for i in ("", ".gz", ".xz", ".bz2") if i != ext]
+            for row in cur.execute(
+                "select catalog_id,filename from catalog"
+                " where replaced is null and filename in (?,?,?)",
+                others,
+            ).fetchall():
+                debug(1, "{} replaced by {}".format(row[1], filename))
+                self._retire_catalog(cur, row[0])
+        cur.close()
+
+    def _new_catalog(self, cur, filename, pending):
+        st, sha256 = pending
+        cur.execute(
+            "insert into catalog (filename,timestamp,size,done,sha256,root) values (?,?,?,?,?,?)",
+            (filename, st.st_mtime, st.st_size, 0, sha256, self.archive),
+        )
+        return cur.lastrowid
+
+    def _end_catalog(self, cur, filename, catalog_id, nb):
+        # sys.stdout.write(" found {} file(s)\n".format(nb))
+        debug(1, "{} entries added: {}".format(filename, nb))
+
+        cur.execute("update catalog set done=1,count=? where rowid=?", [nb, catalog_id])
+
+        self.active_catalog.append(catalog_id)
+        self.rows += nb
+
+    def _inserter(self, cur, catalog_id):
+        """
+        retourne la fonction d'insertion des entrées d'un catalogue, par lots,
+        et la fonction qui écrit le dernier lot
+        """
+        rows = []
+
+        def flush():
+            # un fichier n'est enregistré qu'une fois, quel que soit le nombre de catalogues
+            cur.executemany("insert into staging (filename,size,hash) values (?,?,?)", rows)
+            cur.execute(
+                "insert or ignore into file (filename,size,hash)"
+                " select filename,size,hash from staging"
+            )
+            cur.execute(
+                """\
+insert into package (catalog_id,file_id)
+select ?,f.file_id from staging s
+join file f on f.filename=s.filename and f.size=s.size and f.hash=s.hash""",
+                [catalog_id],
+            )
+            cur.execute("delete from staging")
+            rows.clear()
+
+        def insert(filename, size, md5):
+            rows.append((filename, -1 if size is None else size, md5 or ""))
+            if len(rows) >= mirror.batch_size:
+                flush()
+
+        return insert, flush
+
+    def _read_catalog(self, filename, pending):
+        """
+        lit un catalogue et enregistre ses entrées
+        """
+        mod, func = mirror._catalog_kind(filename)
+
+        cur = self.db.cursor()
+        catalog_id = self._new_catalog(cur, filename, pending)
+
+        # debug(2, "new catalog_id: " + str(catalog_id))
+
+        insert, flush = self._inserter(cur, catalog_id)
+        with mod.open(filename, "rb") as f:
+            nb = func(f, insert, filename)
+        flush()
+
+        self._end_catalog(cur, filename, catalog_id, nb)
+
+        cur.close()
+        self.db.commit()
+
+    @contextlib.contextmanager
+    def _bulk_load(self, massive):
+        """
+        lors d'un chargement massif, et si le profil d'écriture le demande,
+        supprime les index de la table package et les reconstruit à la fin
+        (pas si la base est partagée: les autres archives s'en servent au même moment)
+        """
+        defer = massive and self.profile["defer_indexes"] and not self.shared_db
+        if defer:
+            debug(1, "indexes dropped during bulk load")
+            self.db.execute("drop index if exists package_fk")
+            self.db.execute("drop index if exists package_file")
+        try:
+            yield
+        finally:
+            if defer:
+                with timer("indexes"):
+                    for sql in mirror.indexes:
+                        self.db.execute(sql)
+                    self.db.commit()
+            self._gc_files()
+
+    def _gc_files(self):
+        """
+        supprime les fichiers qui ne sont plus listés par aucun catalogue
+        """
+        cur = self.db.cursor()
+        cur.execute(
+            "delete from file"
+            " where not exists (select 1 from package p where p.file_id=file.file_id)"
+        )
+        debug(2, "{} unreferenced file(s) removed".format(cur.rowcount))
+        cur.close()
+        self.db.commit()
+
+    def parse(self, filename, path):
+        """
+        lit un fichier ou une arborescence de fichiers Packages et Sources
+        """
+        pending = self._pending(filename, path)
+        if pending is not None:
+            self._read_catalog(filename, pending)
+        self.db.commit()
+
+    def parse_files(self, catalogs, jobs=1):
+        """
+        lit une liste de catalogues (filename, path), retourne le nombre de catalogues lus
+        si jobs > 1, la décompression et l'analyse sont réparties sur plusieurs processus,
+        les insertions dans la base restent faites par le processus principal
+        """
+        catalogs = mirror._select_catalogs(catalogs)
+        self._retire_variants(catalogs)
+
+        pending = dict()
+        for filename, path in catalogs:
+            i = self._pending(filename, path)
+            if i is not None:
+                pending[filename] = i
+        self.db.commit()
+
+        if len(pending) == 0:
+            return 0
+
+        # index reconstruits à la fin si au moins la moitié des catalogues est à relire
+        with self._bulk_load(len(pending) * 2 >= len(catalogs)):
 
-                        self.active_catalog.append(catalog_id)
+            if jobs <= 1:
+                for filename, i in pending.items():
+                    self._read_catalog(filename, i)
+                return len(pending)
 
+            debug(1, "parsing {} catalog(s) with {} jobs".format(len(pending), jobs))
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(_parse_worker, filename) for filename in pending]
+                for future in concurrent.futures.as_completed(futures):
+                    filename, rows = future.result()
+
+                    cur = self.db.cursor()
+                    catalog_id = self._new_catalog(cur, filename, pending[filename])
+                    insert, flush = self._inserter(cur, catalog_id)
+                    for row in rows:
+                        insert(*row)
+                    flush()
+                    self._end_catalog(cur, filename, catalog_id, len(rows))
                     cur.close()
                     self.db.commit()
 
+        return len(pending)
+
     def set_dists_db(self):
         cur = self.db.cursor()
         self.active_catalog = []
-        for row in cur.execute("select distinct catalog_id from catalog"):
+        for row in cur.execute(
+            "select catalog_id from catalog where replaced is null"
+            " and (root is null or ? is null or root=?)",
+            [self.archive, self.archive],
+        ):
             self.active_catalog.append(row[0])
         cur.close()
         debug(1, "dists-db: {}".format(str(self.active_catalog)))
@@ -325,7 +1266,8 @@ create index if not exists package_fk on package (catalog_id);
         )
         nb1 = cur.fetchone()[0]
         cur.execute(
-            "select count(distinct hash) from package where catalog_id in ({})".format(
+            "select count(distinct nullif(f.hash,'')) from package p"
+            " join file f on f.file_id=p.file_id where p.catalog_id in ({})".format(
                 ",".join([str(i) for i in self.active_catalog])
             )
         )
@@ -333,106 +1275,711 @@ create index if not exists package_fk on package (catalog_id);
         cur.close()
         print("Total: {} file(s), {} unique".format(nb1, nb2))
 
-    def get_pool_marker(self):
+    def _catalog_location(filename):
         """
-        retourne la date du dernier scan du pool ou la date courante
+        retourne (suite, composant, architecture) d'un catalogue d'après son chemin sous dists/
         """
-        try:
-            with open(self.marker, "r") as f:
-                d = json.load(f)
-        except FileNotFoundError:
-            d = dict()
-        t = d.get(self.pool, time.time())
-        return t
+        parts = filename.split("/")
+        if "dists" not in parts:
+            return ("?", "?", "?")
+        parts = parts[len(parts) - parts[::-1].index("dists") : -1]
+        if len(parts) < 3:
+            return (parts[0] if parts else "?", "?", "?")
+        kind = parts[-1]
+        arch = kind[len("binary-") :] if kind.startswith("binary-") else kind
+        return (parts[0], "/".join(parts[1:-1]), arch)
+
+    def _source_package(filename):
+        """
+        retourne le paquet source d'un fichier du pool: pool/<composant>/<préfixe>/<source>/...
+        """
+        parts = filename.split("/")
+        return parts[3] if len(parts) > 4 and parts[0] == "pool" else "?"
 
-    def set_pool_marker(self):
+    def report(self, top=20):
         """
-        écrit la date courante pour le pool si absente
+        occupation du miroir, calculée dans la base: octets par suite/composant/architecture,
+        octets partagés entre suites ou propres à une suite, octets par paquet source
+        chaque fichier n'est compté qu'une fois par groupe
+        le rapport complet est écrit dans report.json
         """
-        try:
-            with open(self.marker, "r") as f:
-                d = json.load(f)
-        except FileNotFoundError:
-            d = dict()
-        t = d.get(self.pool, 0)
-        if t == 0:
-            t = time.time()
-            d[self.pool] = t
-            with open(self.marker, "w") as f:
-                json.dump(d, f)
-        return t
+        cur = self.db.cursor()
+        self._set_active(cur)
 
-    def set_pool(self, pool, scandir=False):
+        cur.execute(
+            "create temp table if not exists location"
+            " (catalog_id integer primary key, suite text, component text, arch text)"
+        )
+        cur.execute("delete from location")
+        cur.executemany(
+            "insert into location (catalog_id,suite,component,arch) values (?,?,?,?)",
+            [
+                (row[0],) + mirror._catalog_location(row[1])
+                for row in cur.execute(
+                    "select c.catalog_id,c.filename from catalog c"
+                    " join active a on a.catalog_id=c.catalog_id"
+                ).fetchall()
+            ],
+        )
 
-        self.pool = pool
-        self.pool_files = None
+        result = {"location": [], "suites": [], "sources": []}
+
+        print("Space by suite/component/architecture:")
+        for suite, component, arch, n, size in cur.execute(
+            """select suite,component,arch,count(*),sum(size) from (
+    select distinct l.suite,l.component,l.arch,f.file_id,max(f.size,0) size
+    from package p join location l on l.catalog_id=p.catalog_id
+    join file f on f.file_id=p.file_id
+)
+group by suite,component,arch order by suite,component,arch"""
+        ):
+            result["location"].append(
+                {"suite": suite, "component": component, "arch": arch, "files": n, "bytes": size}
+            )
+            print("  {}/{}/{}: {} file(s), {} byte(s)".format(suite, component, arch, n, size))
+
+        # ensemble des suites qui référencent chaque fichier
+        suites = dict()
+        for key, n, size in cur.execute(
+            """select suites,count(*),sum(size) from (
+    select group_concat(suite) suites,size from (
+        select distinct p.file_id,l.suite,max(f.size,0) size
+        from package p join location l on l.catalog_id=p.catalog_id
+        join file f on f.file_id=p.file_id
+        order by p.file_id,l.suite
+    )
+    group by file_id
+)
+group by suites"""
+        ):
+            key = ",".join(sorted(key.split(",")))
+            count, total = suites.get(key, (0, 0))
+            suites[key] = (count + n, total + size)
+
+        print("Space shared between suites:")
+        for key, (n, size) in sorted(suites.items(), key=lambda i: (i[0].count(","), i[0])):
+            names = key.split(",")
+            result["suites"].append({"suites": names, "files": n, "bytes": size})
+            label = "only " + key if len(names) == 1 else " + ".join(names)
+            print("  {}: {} file(s), {} byte(s)".format(label, n, size))
+        print(
+            "  total: {} file(s), {} byte(s)".format(
+                sum(i[0] for i in suites.values()), sum(i[1] for i in suites.values())
+            )
+        )
 
-        if scandir:
+        self.db.create_function("source_package", 1, mirror._source_package, deterministic=True)
+        sources = cur.execute(
+            """select source_package(f.filename) source,count(*),sum(max(f.size,0)) size from file f
+where f.file_id in (
+    select p.file_id from package p join active a on a.catalog_id=p.catalog_id
+)
+group by source order by size desc"""
+        ).fetchall()
+        print(
+            "Space by source package (top {} of {}):".format(min(top, len(sources)), len(sources))
+        )
+        for i, (source, n, size) in enumerate(sources):
+            result["sources"].append({"source": source, "files": n, "bytes": size})
+            if i < top:
+                print("  {}: {} file(s), {} byte(s)".format(source, n, size))
 
-            self.pool_files = dict()
-            cur = self.db.cursor()
+        cur.close()
 
-            can_load = False
+        report_file = os.path.join(self.tmp_dir, "report.json")
+        debug(1, "report in " + report_file)
+        with open(report_file, "w") as f:
+            json.dump(result, f, indent=2)
 
-            # le marker n'existe pas: on scan et on le crée
-            # le marker existe:
-            #   si sa date de modification est la même ou plus ancienne, on charge
-            #   si sa date de modification est plus récente, on scanne et on ne récrée pas le fichier
+    def save_generation(self, keep=7):
+        """
+        enregistre les catalogues actifs comme une nouvelle génération de l'archive,
+        s'ils ont changé, et ne conserve que ses keep dernières générations
+        retourne le numéro de la génération courante
+        """
+        cur = self.db.cursor()
+        active = sorted(set(self.active_catalog))
 
-            cur.execute("select count(*) from pool")
-            if cur.fetchone()[0] > 0:
+        cur.execute("select max(generation_id) from generation where root is ?", [self.archive])
+        generation_id = cur.fetchone()[0]
+        if generation_id is not None:
+            previous = [
+                row[0]
                 for row in cur.execute(
-                    "select timestamp from pool_scanned where filename=?", [self.pool]
-                ):
-                    can_load = self.get_pool_marker() <= row[0]
-                    if can_load:
-                        debug(1, "previous scan up to date")
-                if not can_load:
-                    debug(1, "previous scan out of date, will rescan")
+                    "select catalog_id from generation_catalog where generation_id=?"
+                    " order by catalog_id",
+                    [generation_id],
+                )
+            ]
+        if generation_id is None or previous != active:
+            cur.execute(
+                "insert into generation (timestamp,root) values (?,?)", [time.time(), self.archive]
+            )
+            generation_id = cur.lastrowid
+            cur.executemany(
+                "insert into generation_catalog (generation_id,catalog_id) values (?,?)",
+                [(generation_id, i) for i in active],
+            )
+            debug(1, "generation {}: {} catalog(s)".format(generation_id, len(active)))
+
+        # générations trop anciennes, et catalogues remplacés qui ne servent plus
+        cur.execute(
+            "delete from generation where root is ? and generation_id not in (select generation_id"
+            " from generation where root is ? order by generation_id desc limit ?)",
+            [self.archive, self.archive, max(keep, 1)],
+        )
+        cur.execute(
+            "delete from generation_catalog"
+            " where generation_id not in (select generation_id from generation)"
+        )
+        cur.execute(
+            "delete from package where catalog_id in (select catalog_id from catalog"
+            " where replaced is not null"
+            " and catalog_id not in (select catalog_id from generation_catalog))"
+        )
+        packages = cur.rowcount
+        cur.execute(
+            "delete from catalog where replaced is not null"
+            " and catalog_id not in (select catalog_id from generation_catalog)"
+        )
+        if cur.rowcount > 0:
+            debug(1, "{} replaced catalog(s) dropped".format(cur.rowcount))
+        if packages > 0:
+            self._gc_files()
+
+        cur.close()
+        self.db.commit()
+        return generation_id
+
+    def _generation_files(self, generation_id):
+        """
+        fichiers d'une génération, triés par nom: (filename, size, hash)
+        """
+        return self.db.execute(
+            """select f.filename,f.size,f.hash from file f
+where f.file_id in (
+    select p.file_id from package p join generation_catalog g on g.catalog_id=p.catalog_id
+    where g.generation_id=?
+)
+group by f.filename order by f.filename""",
+            [generation_id],
+        )
+
+    def diff(self, old=None, new=None):
+        """
+        différence entre deux générations (par défaut, l'avant-dernière et la dernière),
+        par fusion des deux listes triées de fichiers
+        écrit les fichiers diff.added, diff.removed et diff.changed
+        retourne un dictionnaire added/removed/changed -> {filename: size}
+        """
+        generations = [
+            row[0]
+            for row in self.db.execute(
+                "select generation_id from generation where root is ? order by 1", [self.archive]
+            )
+        ]
+        if new is None:
+            new = generations[-1] if generations else None
+        if old is None:
+            older = [i for i in generations if new is not None and i < new]
+            old = older[-1] if older else None
+        for i in (old, new):
+            if i is not None and i not in generations:
+                raise generation_error("unknown generation: {}".format(i))
+
+        delta = {"added": dict(), "removed": dict(), "changed": dict()}
+        end = (None, None, None)
+        a = iter(self._generation_files(old) if old is not None else [])
+        b = iter(self._generation_files(new) if new is not None else [])
+        x = next(a, end)
+        y = next(b, end)
+        while x is not end or y is not end:
+            if y is end or (x is not end and x[0] < y[0]):
+                delta["removed"][x[0]] = x[1]
+                x = next(a, end)
+            elif x is end or y[0] < x[0]:
+                delta["added"][y[0]] = y[1]
+                y = next(b, end)
+            else:
+                if x[1:] != y[1:]:
+                    delta["changed"][y[0]] = y[1]
+                x = next(a, end)
+                y = next(b, end)
+
+        print(
+            "Generation {} -> {}: {} added, {} removed, {} changed".format(
+                old, new, len(delta["added"]), len(delta["removed"]), len(delta["changed"])
+            )
+        )
+        for key, files in delta.items():
+            with open(os.path.join(self.tmp_dir, "diff." + key), "w") as f:
+                for i in sorted(files):
+                    f.write(i)
+                    f.write("\n")
+        return delta
+
+    def apply_diff(self, delta):
+        """
+        limite les fichiers manquants et en trop à la différence entre deux générations:
+        seuls les fichiers ajoutés, modifiés ou retirés sont cherchés dans le pool
+        """
+        assert self.pool
+
+        missing = dict()
+        for files in (delta["added"], delta["changed"]):
+            for filename, filesize in files.items():
+                if self.scanned:
+                    size = self.pool_files.get(filename, -1)
+                else:
+                    p = os.path.join(self.pool, filename)
+                    size = os.path.getsize(p) if os.path.exists(p) else -1
+                if size != filesize:
+                    debug(3, "MISSING {} {} {}".format(self.pool, filename, filesize))
+                    missing[filename] = filesize
+
+        self.urls = sorted(missing)
+        self.sizes = missing
+        self._write_missing()
+        print("Missing: {} file(s) of the delta".format(len(missing)))
+
+        self.excess = 0
+        total_size = 0
+        with open(os.path.join(self.tmp_dir, "excess"), "w") as f:
+            for filename in sorted(delta["removed"]):
+                p = os.path.join(self.pool, filename)
+                if os.path.exists(p):
+                    self.excess += 1
+                    total_size += os.path.getsize(p)
+                    f.write(filename)
+                    f.write("\n")
+        print("Excess: {} file(s) for {} byte(s) of the delta".format(self.excess, total_size))
+        return len(missing)
+
+    def get_pool_marker(self):
+        """
+        retourne la date du dernier scan du pool ou la date courante
+        """
+        try:
+            with open(self.marker, "r") as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            d = dict()
+        t = d.get(self.pool, time.time())
+        return t
+
+    def set_pool_marker(self):
+        """
+        écrit la date courante pour le pool si absente
+        le fichier est partagé par les archives vérifiées en parallèle: il est verrouillé
+        pendant la mise à jour, et remplacé de façon atomique pour get_pool_marker
+        """
+        with open(self.marker + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.marker, "r") as f:
+                    d = json.load(f)
+            except FileNotFoundError:
+                d = dict()
+            t = d.get(self.pool, 0)
+            if t == 0:
+                t = time.time()
+                d[self.pool] = t
+                with open(self.marker + ".tmp", "w") as f:
+                    json.dump(d, f)
+                os.replace(self.marker + ".tmp", self.marker)
+        return t
+
+    def _list_dir(self, dirname):
+        """
+        retourne les sous-répertoires et les fichiers (nom -> taille) d'un répertoire du pool
+        """
+        subdirs = []
+        files = dict()
+        for i in os.scandir(os.path.join(self.pool, dirname)):
+            if i.is_dir():
+                subdirs.append(os.path.join(dirname, i.name))
+            elif i.is_file():
+                files[os.path.join(dirname, i.name)] = i.stat().st_size
+        return subdirs, files
+
+    def _walk_pool(self, root, known, children, out, spawn=None, split=None, resume=False):
+        """
+        parcourt un sous-arbre du pool, sans accès à la base (peut être exécuté dans un thread)
+        out reçoit (dirname, mtime, subdirs, files) pour chaque répertoire modifié,
+        et (dirname, mtime, None, None) pour chaque répertoire inchangé
+        si spawn est donné, les répertoires de profondeur split lui sont confiés
+        avec resume (scan interrompu), les sous-répertoires des répertoires inchangés sont relus:
+        ceux qui n'avaient pas encore été parcourus ne sont pas connus de la base
+        """
+        r = [root]
+        while len(r) > 0:
+            dirname = r.pop()
+            try:
+                mtime = os.stat(os.path.join(self.pool, dirname)).st_mtime
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            if known.get(dirname) == mtime:
+                # répertoire inchangé: ses sous-répertoires sont ceux déjà connus
+                if resume:
+                    subdirs = [
+                        os.path.join(dirname, i.name)
+                        for i in os.scandir(os.path.join(self.pool, dirname))
+                        if i.is_dir()
+                    ]
+                else:
+                    subdirs = children.get(dirname, [])
+                out((dirname, mtime, None, None))
+            else:
+                subdirs, files = self._list_dir(dirname)
+                out((dirname, mtime, subdirs, files))
+
+            for i in subdirs:
+                if spawn is not None and i.count("/") == split:
+                    spawn(i)
+                else:
+                    r.append(i)
+
+    def _scan_pool(self, cur, threads=1, on_change=None, resume=False):
+        """
+        scan incrémental du pool: la date de modification de chaque répertoire est conservée,
+        seuls les répertoires modifiés depuis le scan précédent sont relus.
+        un fichier ajouté, supprimé ou renommé (rsync, debmirror) modifie son répertoire,
+        un fichier réécrit sur place non.
+
+        avec threads > 1, les sous-arbres pool/<section>/<lettre> sont parcourus en parallèle,
+        les écritures dans la base restent faites par le thread principal
+        la base est validée régulièrement: après une interruption, les répertoires déjà relus
+        sont reconnus à leur date et le scan reprend là où il s'était arrêté
+        on_change(filename, size) est appelé pour chaque fichier ajouté, modifié
+        ou supprimé (size None)
+        """
+        known = dict()
+        children = dict()
+        for row in cur.execute("select dirname,mtime from pool_dir where root=?", [self.pool]):
+            known[row[0]] = row[1]
+            children.setdefault(os.path.dirname(row[0]), []).append(row[0])
+
+        seen = set()
+        rescanned = 0
+        listed = 0
+        added = 0
+        removed = 0
+        inserts = []
+
+        def flush():
+            cur.executemany(
+                "insert into pool (root,filename,size,hash) values (?,?,?,?)", inserts
+            )
+            inserts.clear()
+
+        def apply(item):
+            """
+            applique à la table pool la différence pour un répertoire relu
+            """
+            nonlocal rescanned, listed, added, removed
+
+            dirname, mtime, subdirs, files = item
+            seen.add(dirname)
+            if files is None:
+                return
+
+            # fichiers connus directement dans ce répertoire
+            old = dict()
+            for row in cur.execute(
+                "select filename,size from pool where root=? and filename>? and filename<?",
+                [self.pool, dirname + "/", dirname + "0"],
+            ):
+                if row[0].find("/", len(dirname) + 1) == -1:
+                    old[row[0]] = row[1]
+
+            deleted = [(self.pool, i) for i, size in old.items() if files.get(i) != size]
+            if deleted:
+                cur.executemany("delete from pool where root=? and filename=?", deleted)
+
+            for i, size in files.items():
+                if old.get(i) != size:
+                    inserts.append((self.pool, i, size, pool_index.key(i)))
+                    added += 1
+                    if on_change is not None:
+                        on_change(i, size)
+            if len(inserts) >= mirror.batch_size:
+                flush()
+
+            for i in old:
+                if i not in files:
+                    removed += 1
+                    if on_change is not None:
+                        on_change(i, None)
+            rescanned += 1
+            listed += len(files)
+            cur.execute(
+                "insert or replace into pool_dir (root,dirname,mtime) values (?,?,?)",
+                (self.pool, dirname, mtime),
+            )
+            if rescanned % mirror.checkpoint_dirs == 0:
+                flush()
+                self.db.commit()
+
+        start = time.perf_counter()
+
+        if threads <= 1:
+            self._walk_pool("pool", known, children, apply, resume=resume)
+
+        else:
+            results = queue.Queue()
+
+            def walk(root):
+                try:
+                    self._walk_pool(root, known, children, results.put, resume=resume)
+                finally:
+                    results.put(None)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+                futures = []
+                self._walk_pool(
+                    "pool",
+                    known,
+                    children,
+                    apply,
+                    lambda root: futures.append(executor.submit(walk, root)),
+                    2,
+                    resume,
+                )
+                debug(1, "scanning {} subtree(s) with {} threads".format(len(futures), threads))
+
+                running = len(futures)
+                while running > 0:
+                    item = results.get()
+                    if item is None:
+                        running -= 1
+                    else:
+                        apply(item)
+
+                for future in futures:
+                    future.result()
+
+        flush()
+
+        # répertoires disparus
+        for dirname in known:
+            if dirname not in seen:
+                cur.execute(
+                    "delete from pool_dir where root=? and dirname=?", [self.pool, dirname]
+                )
+                if on_change is not None:
+                    for row in cur.execute(
+                        "select filename from pool where root=? and filename>? and filename<?",
+                        [self.pool, dirname + "/", dirname + "0"],
+                    ).fetchall():
+                        on_change(row[0], None)
+                cur.execute(
+                    "delete from pool where root=? and filename>? and filename<?",
+                    [self.pool, dirname + "/", dirname + "0"],
+                )
+                removed += cur.rowcount
+
+        elapsed = time.perf_counter() - start
+        self.stats["dirs_scanned"] = len(seen)
+        self.stats["files_scanned"] = listed
+        print(
+            "Pool scan: {} dir(s), {} rescanned, {} file(s) added, {} removed".format(
+                len(seen), rescanned, added, removed
+            )
+        )
+        debug(
+            1,
+            "pool scan: {} file(s) listed in {:.3f} s, {:.0f} files/s, {} dirs/s".format(
+                listed,
+                elapsed,
+                listed / elapsed if elapsed > 0 else 0,
+                int(len(seen) / elapsed) if elapsed > 0 else 0,
+            ),
+        )
+
+    def set_pool(self, pool, scandir=False, threads=1, force=False):
+        """
+        choisit le pool, et si scandir met à jour la table pool (scan incrémental)
+        avec force, le scan incrémental est fait même si le précédent semble à jour
+        l'index compact du pool n'est construit qu'au premier usage (pool_files)
+        """
+
+        self.pool = pool
+        self.scanned = False
+        self._pool_files = None
+        # un fichier d'index par pool, à côté de la base qui les contient tous
+        self.pool_index_file = os.path.join(
+            self.db_dir, "pool.{}.idx".format(hashlib.md5(pool.encode("utf-8")).hexdigest()[:8])
+        )
+
+        if scandir:
+
+            cur = self.db.cursor()
+            self._apply_downloaded(cur)
+
+            can_load = False
+            version = self._pool_version(cur)
+
+            # le marker n'existe pas: on scan et on le crée
+            # le marker existe:
+            #   si sa date de modification est la même ou plus ancienne, on charge
+            #   si sa date de modification est plus récente, on scanne et on ne récrée pas le fichier
+
+            cur.execute("select count(*) from pool where root=?", [self.pool])
+            if cur.fetchone()[0] > 0:
+                for row in cur.execute(
+                    "select timestamp from pool_scanned where filename=?", [self.pool]
+                ):
+                    can_load = self.get_pool_marker() <= row[0] and not force
+                    if can_load:
+                        debug(1, "previous scan up to date")
+                if not can_load:
+                    debug(1, "previous scan out of date, will rescan")
             else:
                 debug(1, "pool db is empty")
 
             if can_load:
                 print("Loading pool {}".format(self.pool))
-
-                for row in cur.execute("select filename,size from pool"):
-                    self.pool_files[row[0]] = row[1]
             else:
                 print("Scanning pool…")
-                cur.execute("delete from pool_scanned")
-                cur.execute("delete from pool")
-                tmp = []
-                r = [os.path.join(self.pool, "pool")]
-                if os.path.isdir(r[0]):
-                    while len(r) > 0:
-                        for i in os.scandir(r.pop()):
-                            if i.is_dir():
-                                r.append(i.path)
-                            elif i.is_file():
-                                path = os.path.relpath(i.path, self.pool)
-                                st = i.stat()
-
-                                self.pool_files[path] = st.st_size
-
-                                tmp.append((path, st.st_size))
-                                if len(tmp) >= 100:
-                                    cur.executemany(
-                                        "insert into pool (filename,size) values (?,?)", tmp
-                                    )
-                                    tmp = []
-
-                if len(tmp) > 0:
-                    cur.executemany("insert into pool (filename,size) values (?,?)", tmp)
 
+                # un scan interrompu est marqué par une date nulle: il est repris
+                cur.execute("select timestamp from pool_scanned where filename=?", [self.pool])
+                row = cur.fetchone()
+                resume = row is not None and row[0] == 0
+                if resume:
+                    print("Resuming interrupted scan")
+
+                # les scans des autres pools sont conservés
+                version += 1
+                cur.execute("delete from pool_scanned where filename=?", [self.pool])
                 cur.execute(
-                    "insert into pool_scanned (filename,timestamp) values (?,?)",
-                    (pool, self.set_pool_marker()),
+                    "insert into pool_scanned (filename,timestamp,version) values (?,?,?)",
+                    (pool, 0, version),
                 )
+                self.db.commit()
+                self._scan_pool(cur, threads, resume=resume)
 
+                scanned = self.set_pool_marker()
+                cur.execute(
+                    "update pool_scanned set timestamp=? where filename=?", (scanned, pool)
+                )
+
+            cur.execute("select count(*) from pool where root=?", [self.pool])
+            self.pool_count = cur.fetchone()[0]
+            self.scanned = True
             cur.close()
             self.db.commit()
 
-            print("Pool: {} file(s) listed".format(len(self.pool_files)))
+            print("Pool: {} file(s) listed".format(self.pool_count))
+
+    @property
+    def pool_files(self):
+        """
+        index compact du pool scanné, projeté depuis le fichier annexe ou construit
+        au premier usage (--diff, surveillance, --index-pool), None sans scan
+        """
+        if self._pool_files is None and self.scanned:
+            cur = self.db.cursor()
+            version = self._pool_version(cur)
+            self._pool_files = pool_index.load(self.pool_index_file, version)
+            if self._pool_files is not None:
+                debug(1, "pool index mapped from {}".format(self.pool_index_file))
+            else:
+                self._pool_files = pool_index.from_db(cur, self.pool)
+                self._pool_files.save(self.pool_index_file, version)
+            cur.close()
+        return self._pool_files
+
+    def _pool_version(self, cur, bump=False):
+        """
+        version de la table pool du pool, incrémentée à chaque modification hors scan
+        """
+        if bump:
+            cur.execute(
+                "update pool_scanned set version=coalesce(version,0)+1 where filename=?",
+                [self.pool],
+            )
+        cur.execute("select coalesce(version,0) from pool_scanned where filename=?", [self.pool])
+        row = cur.fetchone()
+        return row[0] if row else 0
+
+    def _apply_downloaded(self, cur):
+        """
+        reporte dans la table pool les fichiers du journal des téléchargements,
+        y compris ceux d'une exécution interrompue, puis vide le journal
+        """
+        journal = os.path.join(self.tmp_dir, "downloaded")
+        try:
+            with open(journal) as f:
+                rows = []
+                for line in f:
+                    size, _, filename = line.rstrip("\n").partition(" ")
+                    if filename:
+                        rows.append((self.pool, filename, int(size), pool_index.key(filename)))
+        except FileNotFoundError:
+            return
+        cur.executemany("delete from pool where root=? and filename=?", [r[:2] for r in rows])
+        cur.executemany("insert into pool (root,filename,size,hash) values (?,?,?,?)", rows)
+        # le fichier annexe de l'index ne correspond plus à la table pool
+        self._pool_version(cur, True)
+        self.db.commit()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.pool_index_file)
+        os.unlink(journal)
+        debug(1, "{} downloaded file(s) added to the pool index".format(len(rows)))
+
+    def export_state(self, filename):
+        """
+        exporte l'index du pool: une ligne "chemin taille" par fichier, triée
+        """
+        with open(filename + ".tmp", "w") as f:
+            for row in self.db.execute(
+                "select filename,size from pool where root=? order by filename", [self.pool]
+            ):
+                f.write("{} {}\n".format(row[0], row[1]))
+        os.replace(filename + ".tmp", filename)
+        print("Writing pool state into {}".format(filename))
+
+    def export_index(self, filename):
+        """
+        exporte les fichiers listés et ceux du pool dans l'index des serveurs frontaux
+        """
+        cur = self.db.cursor()
+        self._set_active(cur)
+        self.db.commit()
+        # un chemin listé avec plusieurs tailles ou hash: le plus récent
+        sql = """\
+select f.filename,f.size,coalesce(pool.size,-1),f.hash,max(f.file_id)
+from package p join active a on a.catalog_id=p.catalog_id
+join file f on f.file_id=p.file_id
+left join pool on pool.root=? and pool.filename=f.filename
+group by f.filename
+union all
+select filename,-1,size,null,null from pool
+where root=? and not exists (
+    select 1 from file f join package p on p.file_id=f.file_id
+    join active a on a.catalog_id=p.catalog_id
+    where f.filename=pool.filename
+)
+order by 1"""
+        n = lookup_index.write(
+            filename, (row[:4] for row in cur.execute(sql, [self.pool, self.pool])), time.time()
+        )
+        cur.close()
+        print("Writing lookup index of {} file(s) into {}".format(n, filename))
+        return n
+
+    def _set_active(self, cur):
+        """
+        recopie la liste des catalogues actifs dans une table temporaire, pour les jointures
+        """
+        cur.execute("create temp table if not exists active (catalog_id integer primary key)")
+        cur.execute("delete from active")
+        cur.executemany(
+            "insert or ignore into active (catalog_id) values (?)",
+            [(i,) for i in self.active_catalog],
+        )
 
     def find_missing(self):
         """
@@ -443,34 +1990,46 @@ create index if not exists package_fk on package (catalog_id);
 
         print("Searching for missing files…")
 
-        sql = "select filename,size,catalog_id from package where catalog_id in ({})".format(
-            ",".join([str(i) for i in self.active_catalog])
-        )
         cur = self.db.cursor()
+        self._set_active(cur)
 
-        missing = set()
+        missing = dict()
         catalog = set()
 
-        for row in cur.execute(sql):
-
-            filename = row[0]
-            filesize = row[1]
-            catalog_id = row[2]
-
-            if self.pool_files is None:
+        if not self.scanned:
+            # pas de scan: une vérification par fichier distinct
+            sql = """\
+select f.filename,f.size,group_concat(p.catalog_id)
+from package p join active a on a.catalog_id=p.catalog_id
+join file f on f.file_id=p.file_id
+group by p.file_id"""
+            for filename, filesize, catalog_ids in cur.execute(sql):
                 p = os.path.join(self.pool, filename)
                 size = os.path.getsize(p) if os.path.exists(p) else -1
-            else:
-                size = self.pool_files.get(filename, -1)
+                if size == -1:
+                    debug(3, "MISSING {} {} {}".format(self.pool, filename, filesize))
+                    missing[filename] = filesize
+                    catalog.update(catalog_ids.split(","))
+                elif size != filesize:
+                    debug(3, "BAD {} {} {}".format(self.pool, filename, filesize))
+                    missing[filename] = filesize
 
-            if size == -1:
-                debug(3, "MISSING {} {} {}".format(self.pool, filename, filesize))
-                missing.add(filename)
-                catalog.add(catalog_id)
-            else:
-                if size != filesize:
+        else:
+            # jointure avec le scan du pool
+            sql = """\
+select f.filename,f.size,p.catalog_id,pool.size
+from package p join active a on a.catalog_id=p.catalog_id
+join file f on f.file_id=p.file_id
+left join pool on pool.root=? and pool.filename=f.filename
+where pool.size is null or pool.size!=f.size"""
+            for filename, filesize, catalog_id, size in cur.execute(sql, [self.pool]):
+                if size is None:
+                    debug(3, "MISSING {} {} {}".format(self.pool, filename, filesize))
+                    missing[filename] = filesize
+                    catalog.add(catalog_id)
+                else:
                     debug(3, "BAD {} {} {}".format(self.pool, filename, filesize))
-                    missing.add(filename)
+                    missing[filename] = filesize
 
         n = len(missing)
         if n > 0:
@@ -486,7 +2045,12 @@ create index if not exists package_fk on package (catalog_id);
         cur.close()
 
         self.urls = sorted(missing)
+        self.sizes = missing
+        self._write_missing()
+
+        return n
 
+    def _write_missing(self):
         missing_file = os.path.join(self.tmp_dir, "missing")
         debug(1, "missing in " + missing_file)
         with open(missing_file, "w") as f:
@@ -494,7 +2058,153 @@ create index if not exists package_fk on package (catalog_id);
                 f.write(i)
                 f.write("\n")
 
-        return n
+    def verify_hashes(self, jobs=None, rate=None):
+        """
+        rate limite le débit total de lecture, réparti entre les processus
+        vérifie le hash des fichiers présents du pool (MD5sum des Packages, SHA256 des Sources)
+        les hash calculés sont conservés avec la taille, la date et l'inode du fichier:
+        seuls les fichiers nouveaux ou modifiés sont relus
+        les fichiers corrompus sont ajoutés aux fichiers manquants
+        """
+        assert self.pool
+
+        print("Verifying hashes…")
+
+        # hash attendu selon sa longueur
+        algos = {32: "md5", 40: "sha1", 64: "sha256"}
+
+        cur = self.db.cursor()
+
+        cache = dict()
+        for row in cur.execute(
+            "select filename,algo,size,mtime,inode,hash from digest where root=?", [self.pool]
+        ):
+            cache[(row[0], row[1])] = row[2:]
+
+        todo = dict()
+        expected = dict()
+        sizes = dict()
+        cached = 0
+        sql = (
+            "select distinct f.filename,f.hash,f.size from package p"
+            " join file f on f.file_id=p.file_id where p.catalog_id in ({})".format(
+                ",".join([str(i) for i in self.active_catalog])
+            )
+        )
+        for filename, hash, size in cur.execute(sql):
+            algo = algos.get(len(hash or ""))
+            if algo is None or filename in self.sizes:
+                continue
+            sizes[filename] = size
+            try:
+                st = os.stat(os.path.join(self.pool, filename))
+            except FileNotFoundError:
+                continue
+            expected[(filename, algo)] = hash
+            row = cache.get((filename, algo))
+            if row is not None and tuple(row[:3]) == (st.st_size, st.st_mtime, st.st_ino):
+                cached += 1
+            else:
+                todo[(filename, algo)] = st
+
+        hashed = 0
+        start = time.perf_counter()
+        rows = []
+        committed = time.monotonic()
+
+        def flush():
+            """
+            enregistre les hash calculés: une exécution interrompue les retrouvera
+            le verrou d'écriture est pris d'emblée (begin immediate), la transaction est courte:
+            les archives vérifiées en parallèle ne s'interbloquent pas sur la base partagée
+            """
+            nonlocal committed
+            if rows:
+                self.db.commit()
+                self.db.execute("begin immediate")
+                cur.executemany(
+                    "insert or replace into digest (root,filename,algo,size,mtime,inode,hash)"
+                    " values (?,?,?,?,?,?,?)",
+                    rows,
+                )
+                self.db.commit()
+                rows.clear()
+            committed = time.monotonic()
+
+        jobs = jobs or os.cpu_count() or 1
+        worker_rate = rate / jobs if rate else None
+        # fenêtre glissante: quelques tâches d'avance par processus, pas une par fichier
+        window = 4 * jobs
+        items = iter(todo.items())
+        pending = dict()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                while True:
+                    for (filename, algo), st in itertools.islice(items, window - len(pending)):
+                        path = os.path.join(self.pool, filename)
+                        future = executor.submit(_hash_worker, path, algo, worker_rate)
+                        pending[future] = (filename, algo)
+                    if not pending:
+                        break
+                    finished, _ = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in finished:
+                        filename, algo = pending.pop(future)
+                        st = todo[(filename, algo)]
+                        try:
+                            digest = future.result()
+                        except OSError as e:
+                            debug(1, "hash error {}: {}".format(filename, e))
+                            continue
+                        hashed += st.st_size
+                        cache[(filename, algo)] = (st.st_size, st.st_mtime, st.st_ino, digest)
+                        rows.append(
+                            (self.pool, filename, algo, st.st_size, st.st_mtime, st.st_ino, digest)
+                        )
+                    if (
+                        len(rows) >= mirror.batch_size
+                        or time.monotonic() - committed >= mirror.commit_interval
+                    ):
+                        flush()
+        finally:
+            # une exécution interrompue garde les hash déjà calculés
+            flush()
+        elapsed = time.perf_counter() - start
+        self.stats["files_hashed"] = len(todo)
+        self.stats["bytes_hashed"] = hashed
+
+        corrupted = set()
+        for (filename, algo), hash in expected.items():
+            row = cache.get((filename, algo))
+            if row is not None and row[3] != hash.lower():
+                debug(3, "CORRUPTED {} {}".format(self.pool, filename))
+                corrupted.add(filename)
+
+        cur.close()
+
+        print(
+            "Hashes: {} file(s) checked, {} from cache, {} byte(s) hashed ({:.1f} MB/s)".format(
+                len(expected), cached, hashed, hashed / elapsed / 1e6 if elapsed > 0 else 0
+            )
+        )
+
+        corrupted_file = os.path.join(self.tmp_dir, "corrupted")
+        with open(corrupted_file, "w") as f:
+            for i in sorted(corrupted):
+                f.write(i)
+                f.write("\n")
+
+        if corrupted:
+            print("Corrupted: {} file(s), listed in {}".format(len(corrupted), corrupted_file))
+            for filename in corrupted:
+                self.sizes[filename] = sizes[filename]
+            self.urls = sorted(self.sizes)
+            self._write_missing()
+        else:
+            print("All hashes are correct")
+
+        return len(corrupted)
 
     def find_excess(self):
         """
@@ -507,14 +2217,22 @@ create index if not exists package_fk on package (catalog_id);
 
         n = 0
 
-        if self.pool_files is not None:
+        if self.scanned:
             cur = self.db.cursor()
+            self._set_active(cur)
 
             total_size = 0
             with open(os.path.join(self.tmp_dir, "excess"), "w") as f:
 
                 for row in cur.execute(
-                    "select filename,size from pool where filename not in (select filename from package)"
+                    """\
+select filename,size from pool
+where root=? and not exists (
+    select 1 from file f join package p on p.file_id=f.file_id
+    join active a on a.catalog_id=p.catalog_id
+    where f.filename=pool.filename
+)""",
+                    [self.pool],
                 ):
                     n += 1
                     f.write(row[0])
@@ -532,6 +2250,83 @@ create index if not exists package_fk on package (catalog_id);
 
         self.excess = n
 
+    def download(self, mirror, jobs=10, host_jobs=4, retries=3, sched=None):
+        """
+        télécharge les fichiers manquants, sans passer par wget
+        """
+        assert jobs >= 1
+
+        # les plus gros fichiers d'abord, pour que les threads finissent ensemble
+        work = [
+            (posixpath.join(mirror, url), os.path.join(self.pool, url), self.sizes.get(url))
+            for url in sorted(self.urls, key=lambda url: self.sizes.get(url) or 0, reverse=True)
+        ]
+        if len(work) == 0:
+            print("Nothing to download")
+            return 0
+
+        print("Downloading {} file(s)…".format(len(work)))
+
+        # journal des fichiers téléchargés, écrit au fil de l'eau: une exécution interrompue
+        # ne les téléchargera pas une seconde fois
+        journal = open(os.path.join(self.tmp_dir, "downloaded"), "a")
+
+        def done(dest, size):
+            journal.write("{} {}\n".format(size, os.path.relpath(dest, self.pool)))
+            journal.flush()
+
+        d = downloader(jobs, host_jobs, retries, sched=sched)
+        start = time.perf_counter()
+        try:
+            failed = set(os.path.relpath(i, self.pool) for i in d.run(work, done))
+        finally:
+            journal.close()
+        elapsed = time.perf_counter() - start
+
+        if self._pool_files is not None:
+            for url in self.urls:
+                if url not in failed:
+                    self.pool_files[url] = self.sizes[url]
+        cur = self.db.cursor()
+        self._apply_downloaded(cur)
+        cur.close()
+
+        failed_file = os.path.join(self.tmp_dir, "failed")
+        with open(failed_file, "w") as f:
+            for url in sorted(failed):
+                f.write(url)
+                f.write("\n")
+
+        self.stats["bytes_downloaded"] = d.bytes
+        print(
+            "Downloaded: {} file(s), {} byte(s) in {:.1f} s ({:.1f} MB/s), {} failed".format(
+                len(work) - len(failed),
+                d.bytes,
+                elapsed,
+                d.bytes / elapsed / 1e6 if elapsed > 0 else 0,
+                len(failed),
+            )
+        )
+        if failed:
+            print("Failed downloads in {}".format(failed_file))
+
+        return len(failed)
+
+    @staticmethod
+    def _partition(urls, sizes, jobs):
+        """
+        répartit les urls en au plus jobs lots de tailles en octets équilibrées:
+        du plus gros au plus petit, chaque fichier va au lot le moins chargé
+        retourne la liste des lots (taille totale, urls triées)
+        """
+        bins = [(0, k, []) for k in range(min(jobs, len(urls)))]
+        heapq.heapify(bins)
+        for url in sorted(urls, key=lambda url: sizes.get(url) or 0, reverse=True):
+            total, k, content = heapq.heappop(bins)
+            content.append(url)
+            heapq.heappush(bins, (total + (sizes.get(url) or 0), k, content))
+        return [(total, sorted(content)) for total, k, content in sorted(bins, key=lambda i: i[1])]
+
     def wget(self, mirror, jobs=10):
         """
         crée le fichier de commandes wget
@@ -561,47 +2356,33 @@ create index if not exists package_fk on package (catalog_id);
             return
         cut = str.count(s, "/")
 
-        n = (nb + jobs - 1) // jobs
-        k = 0
-        j = 0
-        f = None
-
-        # create 'jobs' files of n lines each, except the last
-        debug(2, "{} lines per file".format(n))
-        for url in self.urls:
-            if j == 0:
-                if f is not None:
-                    f.close()
-                k += 1
-                debug(1, "writing file {}, url count: {}".format(k, n - ((n * k) % nb) % n))
-
-                log_file = "/dev/null"
-
-                url_file = os.path.join(self.tmp_dir, "url.{}".format(k))
-                log_file = os.path.join(self.tmp_dir, "log.{}".format(k))
-
-                #   -nv             --no-verbose
-                #   -x              --force-directories
-                #   -nH             --no-host-directories
-                #                   --cut-dirs=number
-                #   -P prefix       --directory-prefix=prefix
-                cmd = "wget -nv -x -nH -P {} --cut-dirs={} -i {} -o {}".format(
-                    self.pool, cut, url_file, log_file
-                )
-                f_cmd.write(cmd + " &\n")
+        # create at most 'jobs' files of about the same size in bytes
+        for k, (total, urls) in enumerate(self._partition(self.urls, self.sizes, jobs), 1):
+            debug(
+                1, "writing file {}, url count: {}, expected bytes: {}".format(k, len(urls), total)
+            )
 
-                f = open(url_file, "w")
+            log_file = "/dev/null"
 
-            debug(3, posixpath.join(mirror, url))
-            f.write(posixpath.join(mirror, url))
-            f.write("\n")
+            url_file = os.path.join(self.tmp_dir, "url.{}".format(k))
+            log_file = os.path.join(self.tmp_dir, "log.{}".format(k))
 
-            j += 1
-            if j >= n:
-                j = 0
+            #   -nv             --no-verbose
+            #   -x              --force-directories
+            #   -nH             --no-host-directories
+            #                   --cut-dirs=number
+            #   -P prefix       --directory-prefix=prefix
+            cmd = "wget -nv -x -nH -P {} --cut-dirs={} -i {} -o {}".format(
+                self.pool, cut, url_file, log_file
+            )
+            f_cmd.write("# {} file(s), {} byte(s)\n".format(len(urls), total))
+            f_cmd.write(cmd + " &\n")
 
-        if f is not None:
-            f.close()
+            with open(url_file, "w") as f:
+                for url in urls:
+                    debug(3, posixpath.join(mirror, url))
+                    f.write(posixpath.join(mirror, url))
+                    f.write("\n")
 
         f_cmd.write("wait\n")
         f_cmd.close()
@@ -626,55 +2407,834 @@ create index if not exists package_fk on package (catalog_id);
         print("Writing cleaning commands into {}".format(cmd_file))
 
 
-def main(args=None):
+class generation_error(ValueError):
     """
-    fonction principale
+        génération de catalogues inconnue (--diff)
     """
-    global verbosity
 
-    parser = argparse.ArgumentParser(description="apt-mirror debian/ubuntu")
-    parser.add_argument("-v", "--verbose", action="count", default=verbosity)
-    parser.add_argument(
-        "-d", "--dists", nargs="+", action="append", help="chemin de l'arborescence /dists/"
-    )
-    parser.add_argument("--dists-db", default=False, action="store_true")
-    parser.add_argument(
-        "-f", "--dists-file", nargs="+", action="append", help="fichier Packages ou Sources"
-    )
-    parser.add_argument("-p", "--pool", help="chemin de l'arborescence /pool/", default="debian")
-    parser.add_argument(
-        "-m", "--mirror", help="URL du serveur mirror", default="http://ftp.fr.debian.org/debian/"
-    )
-    parser.add_argument("-j", "--jobs", help="", type=int, default=1)
-    parser.add_argument("-t", "--tmp-dir", help="")
-    parser.add_argument(
-        "-s",
-        "--scan",
-        help="cherche les fichiers en trop du pool",
-        dest="scan_pool",
-        action="store_true",
-        default=False,
-    )
 
-    args = parser.parse_args(args=args)
+class http_error(IOError):
+    """
+        réponse HTTP inattendue
+    """
+
+    def __init__(self, status, reason):
+        super().__init__("HTTP {} {}".format(status, reason))
+        self.status = status
+
+
+def parse_rate(text):
+    """
+    débit en octets par seconde: 500K, 10M, 1G (multiples de 1024)
+    """
+    text = text.strip().upper()
+    factor = 1
+    for suffix, f in (("K", 1024), ("M", 1024 ** 2), ("G", 1024 ** 3)):
+        if text.endswith(suffix):
+            text, factor = text[:-1], f
+            break
+    return int(float(text) * factor)
+
+
+class throttle:
+    """
+        seau à jetons: limite un débit en octets par seconde (None: pas de limite)
+        partagé entre threads, chaque appel à consume() attend son tour
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            t = max(self.next, now)
+            self.next = t + n / self.rate
+        if t > now:
+            time.sleep(t - now)
+
+
+class scheduler:
+    """
+        ordonnanceur des téléchargements et des vérifications:
+        débit global et par hôte, nombre d'écritures disque simultanées,
+        profils horaires, et nombre de téléchargements simultanés adapté au débit observé
+    """
+
+    # durée minimale d'une fenêtre de mesure, et intervalle de relecture des profils (s)
+    window = 2.0
+    refresh = 30.0
+
+    def __init__(
+        self, jobs=10, rate=None, host_rate=None, writers=None, profiles=None, adaptive=False
+    ):
+        """
+        @param profiles liste de {"start": "HH:MM", "end": "HH:MM", et des clés rate,
+            host_rate, jobs, hash_rate} qui remplacent les valeurs par défaut sur la plage horaire
+        """
+        self.defaults = {"jobs": jobs, "rate": rate, "host_rate": host_rate, "hash_rate": None}
+        self.profiles = profiles or []
+        self.adaptive = adaptive
+        self.writers = threading.Semaphore(writers) if writers else None
+        self.total = throttle()
+        self.hosts = dict()
+        self.cond = threading.Condition()
+        self.active = 0
+        self.settings = None
+        self.checked = None
+        self.limit = None
+        self._apply()
+
+        # fenêtre de mesure de l'adaptation
+        self.start = time.monotonic()
+        self.bytes = 0
+        self.latencies = []
+        self.previous = None
+        self.best_latency = None
+        self.history = [self.limit]
+
+    def load_profiles(filename):
+        """
+        lit les profils horaires; les débits peuvent être écrits "10M"
+        """
+        with open(filename) as f:
+            profiles = json.load(f)
+        for profile in profiles:
+            for key in ("rate", "host_rate", "hash_rate"):
+                if isinstance(profile.get(key), str):
+                    profile[key] = parse_rate(profile[key])
+        return profiles
+
+    def _minutes(hhmm):
+        h, m = hhmm.split(":")
+        return int(h) * 60 + int(m)
+
+    def current(self, now=None):
+        """
+        paramètres en vigueur à l'heure donnée (heure locale par défaut)
+        """
+        t = now or time.localtime()
+        minute = t.tm_hour * 60 + t.tm_min
+        settings = dict(self.defaults)
+        for profile in self.profiles:
+            start = scheduler._minutes(profile["start"])
+            end = scheduler._minutes(profile["end"])
+            # une plage peut passer minuit
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                settings.update({k: v for k, v in profile.items() if k not in ("start", "end")})
+                break
+        return settings
+
+    def _apply(self):
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < scheduler.refresh:
+            return
+        self.checked = now
+        settings = self.current()
+        if settings == self.settings:
+            return
+        debug(1, "scheduler: {}".format(settings))
+        self.settings = settings
+        self.max_jobs = max(1, settings["jobs"])
+        self.total.rate = settings["rate"]
+        for bucket in self.hosts.values():
+            bucket.rate = settings["host_rate"]
+        if not self.adaptive:
+            self.limit = self.max_jobs
+        elif self.limit is None:
+            # démarrage prudent: la latence de référence est mesurée sans encombrement
+            self.limit = min(4, self.max_jobs)
+        else:
+            self.limit = min(self.limit, self.max_jobs)
+
+    def hash_rate(self):
+        return self.current()["hash_rate"]
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        attend qu'un téléchargement puisse commencer
+        """
+        with self.cond:
+            self._apply()
+            while self.active >= self.limit:
+                self.cond.wait(1)
+                self._apply()
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.active -= 1
+                self.cond.notify()
+
+    def transfer(self, netloc, n):
+        """
+        attend que n octets reçus de l'hôte netloc puissent être acceptés
+        """
+        with self.cond:
+            bucket = self.hosts.get(netloc)
+            if bucket is None:
+                bucket = self.hosts[netloc] = throttle(self.settings["host_rate"])
+        bucket.consume(n)
+        self.total.consume(n)
+
+    def writer(self):
+        """
+        limite le nombre d'écritures disque simultanées
+        """
+        return self.writers if self.writers is not None else contextlib.nullcontext()
+
+    def record(self, n, latency):
+        """
+        enregistre un téléchargement terminé: n octets, latence de la première réponse
+        à la fin de chaque fenêtre, augmente le nombre de téléchargements simultanés
+        d'une unité tant que la latence reste proche de la meilleure observée,
+        le réduit d'un quart quand elle double ou que le débit baisse
+        """
+        if not self.adaptive:
+            return
+        with self.cond:
+            self.bytes += n
+            self.latencies.append(latency)
+            elapsed = time.monotonic() - self.start
+            if elapsed < scheduler.window or len(self.latencies) < self.limit:
+                return
+
+            throughput = self.bytes / elapsed
+            latency = sorted(self.latencies)[len(self.latencies) // 2]
+            if self.best_latency is None or latency < self.best_latency:
+                self.best_latency = latency
+
+            if latency > 2 * self.best_latency or (
+                self.previous is not None and throughput < 0.9 * self.previous
+            ):
+                self.limit = max(1, self.limit * 3 // 4)
+            elif latency < 1.5 * self.best_latency:
+                self.limit = min(self.max_jobs, self.limit + 1)
+            debug(
+                2,
+                "scheduler: {:.1f} MB/s, latency {:.3f} s, {} job(s)".format(
+                    throughput / 1e6, latency, self.limit
+                ),
+            )
+            self.history.append(self.limit)
+            self.previous = throughput
+            self.start = time.monotonic()
+            self.bytes = 0
+            self.latencies = []
+            self.cond.notify_all()
+
+
+class downloader:
+    """
+        téléchargements HTTP concurrents
+        chaque thread garde une connexion persistante par hôte,
+        le nombre de requêtes simultanées vers un même hôte est limité
+    """
+
+    def __init__(self, jobs=10, host_jobs=4, retries=3, timeout=60, sched=None):
+        self.sched = sched or scheduler(jobs)
+        self.jobs = jobs
+        self.host_jobs = host_jobs
+        self.retries = retries
+        self.timeout = timeout
+        self.bytes = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hosts = dict()
+
+    def _host_slot(self, scheme, netloc):
+        with self.lock:
+            if (scheme, netloc) not in self.hosts:
+                self.hosts[(scheme, netloc)] = threading.Semaphore(self.host_jobs)
+            return self.hosts[(scheme, netloc)]
+
+    def _connection(self, scheme, netloc):
+        """
+        retourne la connexion du thread courant vers un hôte
+        """
+        if not hasattr(self.local, "connections"):
+            self.local.connections = dict()
+        conn = self.local.connections.get((scheme, netloc))
+        if conn is None:
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            self.local.connections[(scheme, netloc)] = conn
+        return conn
+
+    def _close(self, scheme, netloc):
+        conn = self.local.connections.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _get(self, url, f, offset=0, redirects=5):
+        """
+        écrit le contenu d'une url dans le fichier f, retourne le nombre d'octets
+        si offset > 0, f contient déjà le début du fichier: seule la suite est demandée
+        (si le serveur ignore la demande, f est réécrit depuis le début)
+        les redirections sont suivies hors de la place réservée sur l'hôte:
+        une redirection vers le même hôte la reprendrait
+        """
+        while True:
+            n = self._request(url, f, offset, redirects > 0)
+            if not isinstance(n, str):
+                return n
+            url = n
+            redirects -= 1
+
+    def _request(self, url, f, offset, redirect):
+        """
+        une requête de _get: retourne le nombre d'octets écrits,
+        ou l'url de destination d'une redirection si redirect
+        """
+        u = urllib.parse.urlsplit(url)
+        path = u.path + ("?" + u.query if u.query else "")
+
+        with self._host_slot(u.scheme, u.netloc):
+            conn = self._connection(u.scheme, u.netloc)
+            try:
+                headers = {"Range": "bytes={}-".format(offset)} if offset > 0 else {}
+                start = time.monotonic()
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                self.local.latency = time.monotonic() - start
+
+                if resp.status in (301, 302, 303, 307, 308) and redirect:
+                    resp.read()
+                    return urllib.parse.urljoin(url, resp.getheader("Location"))
+
+                if resp.status == 200 and offset > 0:
+                    f.seek(0)
+                    f.truncate()
+                elif resp.status != 200 and not (resp.status == 206 and offset > 0):
+                    resp.read()
+                    raise http_error(resp.status, resp.reason)
+
+                # petits blocs si le débit est limité, pour un débit régulier
+                limited = self.sched.settings["rate"] or self.sched.settings["host_rate"]
+                n = 0
+                while True:
+                    data = resp.read(65536 if limited else 1048576)
+                    if not data:
+                        break
+                    self.sched.transfer(u.netloc, len(data))
+                    with self.sched.writer():
+                        f.write(data)
+                    n += len(data)
+                return n
+
+            except http_error:
+                raise
+            except (http.client.HTTPException, OSError):
+                # la connexion n'est plus réutilisable
+                self._close(u.scheme, u.netloc)
+                raise
+
+    def fetch(self, url, dest, size=None):
+        """
+        télécharge une url dans un fichier temporaire renommé à la fin
+        un fichier temporaire laissé par une tentative ou une exécution précédente
+        est complété (requête HTTP Range) plutôt que recommencé
+        retourne True si le téléchargement a réussi
+        """
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        part = dest + ".part"
+        keep = True
+
+        for attempt in range(1 + self.retries):
+            if attempt > 0:
+                time.sleep(min(2 ** attempt, 30))
+            try:
+                offset = os.path.getsize(part) if os.path.exists(part) else 0
+                if size is not None and offset > size:
+                    offset = 0
+                with open(part, "r+b" if offset > 0 else "wb") as f:
+                    f.seek(offset)
+                    if size is not None and offset == size:
+                        n = 0
+                    else:
+                        if offset > 0:
+                            debug(2, "resuming {} at {}".format(url, offset))
+                        with self.sched.slot():
+                            n = self._get(url, f, offset)
+                        self.sched.record(n, self.local.latency)
+                    f.truncate()
+                    total = f.tell()
+                if size is not None and total != size:
+                    # contenu incohérent: on recommencera depuis le début
+                    os.unlink(part)
+                    raise IOError("size {} instead of {}".format(total, size))
+                os.replace(part, dest)
+                with self.lock:
+                    self.bytes += n
+                debug(2, "downloaded {} ({} bytes)".format(url, n))
+                return True
+            except http_error as e:
+                debug(1, "download error {}: {}".format(url, e))
+                if e.status == 416 and offset > 0:
+                    # le fichier partiel ne correspond plus: on recommence
+                    os.unlink(part)
+                elif 400 <= e.status < 500:
+                    # inutile de réessayer
+                    keep = False
+                    break
+            except (http.client.HTTPException, OSError) as e:
+                debug(1, "download error {}: {}".format(url, e))
+
+        # un fichier partiel est gardé pour la prochaine exécution, sauf erreur du client
+        if not keep or (os.path.exists(part) and os.path.getsize(part) == 0):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(part)
+        error("Download failed: {}".format(url))
+        return False
+
+    def run(self, work, done=None):
+        """
+        télécharge une liste de (url, destination, taille attendue)
+        done(destination, taille) est appelé pour chaque fichier téléchargé
+        retourne l'ensemble des destinations en échec
+        """
+        failed = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = dict()
+            for url, dest, size in work:
+                futures[executor.submit(self.fetch, url, dest, size)] = (dest, size)
+            for future in concurrent.futures.as_completed(futures):
+                dest, size = futures[future]
+                if not future.result():
+                    failed.add(dest)
+                elif done is not None:
+                    done(dest, os.path.getsize(dest) if size is None else size)
+        return failed
+
+
+class inotify:
+    """
+        accès minimal à inotify(7) par ctypes (Linux)
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    def __init__(self):
+        name = ctypes.util.find_library("c")
+        if name is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify not available")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.paths = dict()
+
+    def add(self, path):
+        """
+        surveille un répertoire; lève OSError si la limite de surveillances est atteinte
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), inotify.MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        self.paths[wd] = path
+
+    def read(self, timeout):
+        """
+        attend des événements au plus timeout secondes
+        retourne une liste de (mask, chemin complet)
+        """
+        events = []
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return events
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            i = 0
+            while i < len(data):
+                wd, mask, cookie, n = struct.unpack_from("iIII", data, i)
+                name = data[i + 16 : i + 16 + n].rstrip(b"\0")
+                i += 16 + n
+                if mask & inotify.IN_IGNORED:
+                    self.paths.pop(wd, None)
+                    continue
+                path = self.paths.get(wd)
+                if mask & inotify.IN_Q_OVERFLOW or path is None:
+                    events.append((inotify.IN_Q_OVERFLOW, None))
+                else:
+                    events.append((mask, os.path.join(path, os.fsdecode(name))))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class watcher:
+    """
+        mode surveillance: garde en mémoire les fichiers attendus et le contenu du pool,
+        met à jour les fichiers manquants et en trop à chaque changement de dists/ ou de pool/
+        (inotify, ou scan incrémental périodique à défaut), et sert l'état courant en HTTP
+    """
+
+    def __init__(self, m, dists, reparse, interval=60, port=None):
+        """
+        @param m mirror dont le pool a été scanné
+        @param dists répertoires dists surveillés
+        @param reparse fonction qui relit les catalogues et recalcule les catalogues actifs
+        """
+        self.m = m
+        self.dists = dists
+        self.reparse = reparse
+        self.interval = interval
+        self.port = port
+        self.lock = threading.Lock()
+        self.expected = dict()
+        self.missing = set()
+        self.excess = set()
+        self.updated = None
+        self.notify = None
+
+    def _load_expected(self):
+        """
+        recharge les fichiers attendus et recalcule les fichiers manquants et en trop
+        """
+        cur = self.m.db.cursor()
+        self.m._set_active(cur)
+        expected = dict()
+        for filename, size in cur.execute(
+            "select f.filename,f.size from package p"
+            " join active a on a.catalog_id=p.catalog_id join file f on f.file_id=p.file_id"
+        ):
+            expected[filename] = size
+        cur.close()
+
+        with self.lock:
+            changed = set(self.expected)
+            changed.symmetric_difference_update(expected)
+            changed.update(i for i, size in expected.items() if self.expected.get(i) != size)
+            self.expected = expected
+            if self.updated is None:
+                changed = set(expected)
+                changed.update(
+                    row[0]
+                    for row in self.m.db.execute(
+                        "select filename from pool where root=?", [self.m.pool]
+                    )
+                )
+            for filename in changed:
+                self._update(filename)
+            self.updated = time.time()
+        debug(1, "watch: {} expected file(s), {} changed".format(len(expected), len(changed)))
+
+    def _update(self, filename):
+        """
+        met à jour l'état d'un fichier (appelé avec le verrou)
+        """
+        size = self.m.pool_files.get(filename)
+        expected = self.expected.get(filename)
+        self.missing.discard(filename)
+        self.excess.discard(filename)
+        if filename in self.expected:
+            if size != expected:
+                self.missing.add(filename)
+        elif size is not None:
+            self.excess.add(filename)
+
+    def _pool_changed(self, filename, size, db=True):
+        if db:
+            # la table pool suit les événements, pour les renommages de répertoires
+            self.m.db.execute(
+                "delete from pool where root=? and filename=?", [self.m.pool, filename]
+            )
+            if size is not None:
+                self.m.db.execute(
+                    "insert into pool (root,filename,size,hash) values (?,?,?,?)",
+                    (self.m.pool, filename, size, pool_index.key(filename)),
+                )
+        with self.lock:
+            if size is None:
+                self.m.pool_files.pop(filename, None)
+            else:
+                self.m.pool_files[filename] = size
+            self._update(filename)
+            self.updated = time.time()
+
+    def _poll(self):
+        """
+        scan incrémental du pool et relecture des catalogues
+        """
+        cur = self.m.db.cursor()
+        self.m._scan_pool(cur, on_change=lambda i, size: self._pool_changed(i, size, False))
+        cur.close()
+        self.m.db.commit()
+        self._refresh_dists()
+
+    def _refresh_dists(self):
+        self.reparse()
+        self._load_expected()
+
+    def _watch_tree(self, root, scan=False):
+        """
+        surveille récursivement un répertoire
+        si scan, signale les fichiers déjà présents (répertoire apparu après le début)
+        """
+        for dirpath, dirnames, filenames in os.walk(root):
+            self.notify.add(dirpath)
+            if scan:
+                for i in filenames:
+                    self._file_event(os.path.join(dirpath, i))
+
+    def _file_event(self, path):
+        filename = os.path.relpath(path, self.m.pool)
+        if filename.endswith(".part"):
+            return
+        try:
+            st = os.stat(path)
+            size = st.st_size if stat.S_ISREG(st.st_mode) else None
+        except FileNotFoundError:
+            size = None
+        self._pool_changed(filename, size)
+
+    def _events(self, events):
+        """
+        traite les événements inotify
+        """
+        dists = False
+        pool_root = os.path.join(self.m.pool, "pool")
+        for mask, path in events:
+            if mask & inotify.IN_Q_OVERFLOW:
+                debug(1, "watch: inotify queue overflow, rescanning")
+                self._poll()
+                return
+            if not path.startswith(pool_root + "/"):
+                dists = True
+                if mask & inotify.IN_ISDIR and mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                    self._watch_tree(path)
+            elif mask & inotify.IN_ISDIR:
+                if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                    self._watch_tree(path, True)
+                elif mask & inotify.IN_MOVED_FROM:
+                    dirname = os.path.relpath(path, self.m.pool)
+                    for row in self.m.db.execute(
+                        "select filename from pool where root=? and filename>? and filename<?",
+                        [self.m.pool, dirname + "/", dirname + "0"],
+                    ).fetchall():
+                        self._pool_changed(row[0], None)
+            else:
+                self._file_event(path)
+        self.m.db.commit()
+        if dists:
+            debug(1, "watch: dists changed")
+            self._refresh_dists()
+
+    def status(self):
+        with self.lock:
+            return {
+                "pool": self.m.pool,
+                "expected": len(self.expected),
+                "pool_files": len(self.m.pool_files),
+                "missing": len(self.missing),
+                "excess": len(self.excess),
+                "updated": self.updated,
+                "mode": "inotify" if self.notify is not None else "poll",
+            }
+
+    def _serve(self):
+        w = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/":
+                    body = json.dumps(w.status())
+                    content_type = "application/json"
+                elif self.path in ("/missing", "/excess"):
+                    with w.lock:
+                        files = sorted(w.missing if self.path == "/missing" else w.excess)
+                    body = "".join(i + "\n" for i in files)
+                    content_type = "text/plain"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                debug(3, "status: " + format % args)
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", self.port), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        print("Status served on http://127.0.0.1:{}/".format(server.server_address[1]))
+        return server
+
+    def _terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    def run(self):
+        """
+        boucle de surveillance, jusqu'à interruption (Ctrl-C ou SIGTERM)
+        """
+        self._load_expected()
+
+        # la table pool va diverger du fichier annexe de l'index
+        cur = self.m.db.cursor()
+        self.m._pool_version(cur, True)
+        cur.close()
+        self.m.db.commit()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.m.pool_index_file)
+
+        try:
+            self.notify = inotify()
+            self._watch_tree(os.path.join(self.m.pool, "pool"))
+            for path in self.dists:
+                self._watch_tree(path)
+            debug(1, "watch: {} directories watched".format(len(self.notify.paths)))
+        except OSError as e:
+            debug(1, "watch: inotify unavailable ({}), polling every {} s".format(e, self.interval))
+            if self.notify is not None:
+                self.notify.close()
+            self.notify = None
+
+        server = self._serve() if self.port is not None else None
+        print(
+            "Watching {} (missing: {}, excess: {})".format(
+                self.m.pool, len(self.missing), len(self.excess)
+            )
+        )
+
+        # arrêt par systemd ou timeout (SIGTERM) comme par Ctrl-C
+        previous = signal.signal(signal.SIGTERM, watcher._terminate)
+        try:
+            while True:
+                if self.notify is not None:
+                    events = self.notify.read(self.interval)
+                    if events:
+                        self._events(events)
+                else:
+                    time.sleep(self.interval)
+                    self._poll()
+                debug(2, "watch: {}".format(self.status()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            if server is not None:
+                server.shutdown()
+            if self.notify is not None:
+                self.notify.close()
+            self.m.db.commit()
+            self.m.export_index(os.path.join(self.m.tmp_dir, "lookup.idx"))
+
+
+# limite de débit d'un processus de calcul des hash, conservée d'un fichier à l'autre
+_hash_throttle = throttle()
+
+
+def _hash_worker(path, algo, rate=None):
+    """
+    tâche d'un processus de mirror.verify_hashes: retourne le hash d'un fichier
+    rate limite le débit de lecture du processus
+    """
+    h = hashlib.new(algo)
+    buffer = bytearray(4 * 1048576 if not rate else 262144)
+    view = memoryview(buffer)
+    bucket = _hash_throttle
+    bucket.rate = rate
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            bucket.consume(n)
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def _check_worker(args, *archive):
+    """
+    vérifie une archive dans un processus fils, retourne les mesures des phases
+    """
+    global verbosity
 
     verbosity = args.verbose
-    debug(2, "args=" + str(args))
+    timer.profile_dir = args.profile
+    # mesures de ce processus seulement: pas celles héritées du parent ni d'une archive précédente
+    timer.phases = []
+    m, _ = check_archive(args, *archive)
+    # le processus peut être réutilisé: la base partagée ne doit pas rester verrouillée
+    # (en cas d'erreur, check_archive l'a déjà annulée et fermée)
+    try:
+        m.db.commit()
+    finally:
+        m.db.close()
+    return timer.phases
+
+
+def _parse_worker(filename):
+    """
+    tâche d'un processus de mirror.parse_files: retourne les entrées d'un catalogue
+    """
+    mod, func = mirror._catalog_kind(filename)
+    rows = []
+    with mod.open(filename, "rb") as f:
+        func(f, lambda filename, size, md5: rows.append((filename, size, md5)), filename)
+    return filename, rows
 
-    # début
-    m = mirror(args.tmp_dir)
 
-    # vérification du répertoire pool
-    if not os.path.isdir(args.pool):
-        debug(1, "not an existing dir: {}".format(args.pool))
-        sys.exit(1)
-    args.pool = os.path.normpath(args.pool)
-    if os.path.basename(args.pool) == "pool":
-        args.pool = os.path.dirname(args.pool)
-    debug(1, "/pool/ " + args.pool)
+def pool_root(path):
+    """
+    racine d'une archive: le répertoire qui contient pool/
+    """
+    path = os.path.normpath(path)
+    if os.path.basename(path) == "pool":
+        path = os.path.dirname(path)
+    return path
+
+
+def archive_name(root):
+    """
+    nom d'une archive pour ses fichiers et ses mesures: nom de sa racine
+    et hash court du chemin absolu (deux racines de même nom restent distinctes)
+    """
+    root = os.path.abspath(root)
+    return "{}-{}".format(
+        os.path.basename(root) or "root", hashlib.md5(root.encode("utf-8")).hexdigest()[:8]
+    )
+
+
+def parse_dists(m, dists_paths, dists_files=None, jobs=1):
+    """
+    analyse les arborescences dists et les fichiers Packages et Sources de la ligne de commande
+    retourne la liste des répertoires dists analysés
+    """
+    dists = []
 
     # analyse des répertoires récursivement, sans tenir des symlinks de plus haut niveau
-    for paths in args.dists or {}:
+    for paths in dists_paths or {}:
         p = []
         for path in paths:
             p += glob.glob(path)
@@ -696,14 +3256,17 @@ def main(args=None):
 
             # debug(2, "scandir: " + path)
             print("Finding files from {}".format(path))
-            for e in os.scandir(path):
-                if e.is_dir(follow_symlinks=False):
-                    debug(2, "analyzing dir: " + e.path)
-                    for i in glob.iglob(os.path.join(e.path, "**"), recursive=True):
-                        m.parse(i, path)
+            dists.append(path)
+            catalogs = list(m.walk_dists(path))
+            n = m.parse_files(catalogs, jobs)
+            print(
+                "Catalogs: {} file(s) visited, {} found, {} parsed".format(
+                    m.visited, len(catalogs), n
+                )
+            )
 
     # analyse des fichiers Packages et Sources nommés
-    for filenames in args.dists_file or {}:
+    for filenames in dists_files or {}:
         for filename in filenames:
             debug(1, "dists_file {}".format(filename))
             if not os.path.isfile(filename):
@@ -711,17 +3274,348 @@ def main(args=None):
                 continue
             m.parse(filename, os.path.dirname(filename))
 
+    return dists
+
+
+def check_archive(args, pool, dists, dists_files, url, tmp_dir, db_dir=None, selection=None):
+    """
+    vérifie une archive: lecture des catalogues, scan du pool, fichiers manquants et en trop
+    retourne le mirror et les répertoires dists analysés
+    """
+    m = mirror(tmp_dir, args.db_profile, selection, pool, db_dir)
+
+    try:
+        dists = _check_phases(m, args, pool, dists, dists_files, url)
+    except BaseException:
+        # la base partagée ne doit pas rester verrouillée (processus fils réutilisé)
+        m.db.rollback()
+        m.db.close()
+        raise
+
+    return m, dists
+
+
+def _check_phases(m, args, pool, dists, dists_files, url):
+    """
+    phases de check_archive, retourne les répertoires dists analysés
+    """
+    debug(1, "/pool/ " + pool)
+
+    with timer("parse") as t:
+        dists = parse_dists(m, dists, dists_files, args.parse_jobs)
+        t.rows = m.rows
+
     if args.dists_db:
         m.set_dists_db()
 
+    with timer("generation"):
+        m.save_generation(args.generations)
+        delta = None
+        if args.diff is not None:
+            delta = m.diff(*args.diff)
+
     # affichage du total
-    m.total()
+    with timer("total"):
+        m.total()
+
+    if args.report:
+        with timer("report"):
+            m.report(args.report_top)
 
     # args.scan_pool = False
-    m.set_pool(args.pool, args.scan_pool)
-    m.find_missing()
-    m.find_excess()
-    m.wget(args.mirror, args.jobs)
+    with timer("pool") as t:
+        m.set_pool(pool, args.scan_pool, args.scan_threads)
+        if m.scanned:
+            t.rows = m.pool_count
+        for key in ("dirs_scanned", "files_scanned"):
+            t.counters[key] = m.stats.get(key)
+    if delta is not None:
+        with timer("delta") as t:
+            t.counters["missing"] = m.apply_diff(delta)
+            t.counters["excess"] = m.excess
+    else:
+        with timer("missing") as t:
+            t.counters["missing"] = m.find_missing()
+    profiles = scheduler.load_profiles(args.schedule) if args.schedule else []
+    sched = scheduler(
+        args.jobs, args.rate, args.host_rate, args.disk_writers, profiles, args.adaptive
+    )
+    if args.verify_hashes:
+        with timer("hashes") as t:
+            t.counters["corrupted"] = m.verify_hashes(
+                args.hash_jobs, args.hash_rate or sched.hash_rate()
+            )
+            for key in ("files_hashed", "bytes_hashed"):
+                t.counters[key] = m.stats.get(key)
+    if delta is None:
+        with timer("excess") as t:
+            m.find_excess()
+            t.counters["excess"] = m.excess
+    with timer("wget"):
+        m.wget(url, min(args.jobs, 20))
+    if args.download:
+        with timer("download") as t:
+            # assez de threads pour le profil horaire le plus large
+            jobs = max([args.jobs] + [p.get("jobs", 0) for p in profiles])
+            t.counters["failed"] = m.download(url, jobs, args.host_jobs, sched=sched)
+            t.counters["bytes_downloaded"] = m.stats.get("bytes_downloaded")
+    if m.scanned:
+        with timer("lookup") as t:
+            t.rows = m.export_index(os.path.join(m.tmp_dir, "lookup.idx"))
+
+    return dists
+
+
+def main(args=None):
+    """
+    fonction principale
+    """
+    global verbosity
+
+    parser = argparse.ArgumentParser(description="apt-mirror debian/ubuntu")
+    parser.add_argument("-v", "--verbose", action="count", default=verbosity)
+    parser.add_argument(
+        "-d", "--dists", nargs="+", action="append", help="chemin de l'arborescence /dists/"
+    )
+    parser.add_argument("--dists-db", default=False, action="store_true")
+    parser.add_argument(
+        "-f", "--dists-file", nargs="+", action="append", help="fichier Packages ou Sources"
+    )
+    parser.add_argument(
+        "--arch",
+        type=lambda s: s.split(","),
+        help="architectures à garder, séparées par des virgules",
+    )
+    parser.add_argument(
+        "--exclude-arch",
+        type=lambda s: s.split(","),
+        help="architectures à exclure, séparées par des virgules",
+    )
+    parser.add_argument(
+        "--section",
+        type=lambda s: s.split(","),
+        help="sections à garder, séparées par des virgules",
+    )
+    parser.add_argument("--filter-config", help="fichier JSON: arch, exclude-arch, section")
+    parser.add_argument(
+        "-p", "--pool", action="append", help="chemin de l'arborescence /pool/ (debian par défaut)"
+    )
+    parser.add_argument(
+        "--index-pool",
+        nargs="+",
+        action="append",
+        help="met à jour l'index partagé de ces archives et exporte leur état",
+    )
+    parser.add_argument("-m", "--mirror", action="append", help="URL du serveur mirror")
+    parser.add_argument("-j", "--jobs", help="", type=int, default=1)
+    parser.add_argument(
+        "--parse-jobs",
+        help="nombre de processus pour l'analyse des catalogues",
+        type=int,
+        default=1,
+    )
+    parser.add_argument("-t", "--tmp-dir", help="")
+    parser.add_argument(
+        "--download",
+        help="télécharge les fichiers manquants au lieu de passer par wget_cmd.sh",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--host-jobs", help="nombre de téléchargements simultanés par hôte", type=int, default=4
+    )
+    parser.add_argument("--rate", help="débit maximal des téléchargements", type=parse_rate)
+    parser.add_argument("--host-rate", help="débit maximal par hôte", type=parse_rate)
+    parser.add_argument(
+        "--disk-writers", help="nombre maximal d'écritures disque simultanées", type=int
+    )
+    parser.add_argument(
+        "--adaptive",
+        help="adapte le nombre de téléchargements simultanés au débit et à la latence",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--schedule",
+        help="fichier JSON des profils horaires: start, end, rate, host_rate, jobs, hash_rate",
+    )
+    parser.add_argument(
+        "--db-profile",
+        help="profil d'écriture de la base",
+        choices=sorted(mirror.profiles),
+        default="default",
+    )
+    parser.add_argument(
+        "--generations",
+        help="nombre de générations de catalogues conservées",
+        type=int,
+        default=7,
+    )
+    parser.add_argument(
+        "--diff",
+        help="vérifie seulement la différence entre deux générations (les 2 dernières)",
+        nargs="*",
+        type=int,
+        metavar="GENERATION",
+    )
+    parser.add_argument(
+        "--report",
+        help="occupation par suite, composant, architecture et paquet source",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--report-top", help="nombre de paquets source affichés", type=int, default=20
+    )
+    parser.add_argument(
+        "-s",
+        "--scan",
+        help="cherche les fichiers en trop du pool",
+        dest="scan_pool",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--verify-hashes",
+        help="vérifie le hash des fichiers présents",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--hash-jobs", help="nombre de processus pour le calcul des hash", type=int, default=None
+    )
+    parser.add_argument("--hash-rate", help="débit maximal de lecture des hash", type=parse_rate)
+    parser.add_argument(
+        "--watch",
+        help="surveille dists/ et pool/ et tient à jour les fichiers manquants et en trop",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--watch-interval",
+        help="délai d'attente des événements, ou de scrutation sans inotify (secondes)",
+        type=float,
+        default=60,
+    )
+    parser.add_argument("--status-port", help="port HTTP de l'état en mode surveillance", type=int)
+    parser.add_argument("--metrics", help="fichier des mesures des phases (lignes JSON)")
+    parser.add_argument("--profile", help="répertoire des profils cProfile de chaque phase")
+    parser.add_argument(
+        "--scan-threads",
+        help="nombre de threads pour le scan du pool",
+        type=int,
+        default=1,
+    )
+
+    args = parser.parse_args(args=args)
+    if args.diff is not None and len(args.diff) > 2:
+        parser.error("--diff takes at most two generations")
+
+    verbosity = args.verbose
+    debug(2, "args=" + str(args))
+
+    run = time.strftime("%Y-%m-%dT%H:%M:%S")
+    timer.profile_dir = args.profile
+
+    # début
+    config = dists_filter.load(args.filter_config) if args.filter_config else dict()
+    selection = dists_filter(
+        args.arch or config.get("arch"),
+        args.exclude_arch or config.get("exclude-arch"),
+        args.section or config.get("section"),
+    )
+
+    m = mirror(args.tmp_dir, args.db_profile, selection)
+
+    # mise à jour de l'index partagé de plusieurs archives (debian, debian-security...)
+    for pools in args.index_pool or []:
+        for pool in pools:
+            if not os.path.isdir(pool):
+                debug(1, "not an existing dir: {}".format(pool))
+                sys.exit(1)
+            pool = pool_root(pool)
+            with timer("index " + archive_name(pool)) as t:
+                m.set_pool(pool, True, args.scan_threads, True)
+                t.rows = len(m.pool_files)
+                m.export_state(os.path.join(m.tmp_dir, archive_name(pool) + ".state"))
+    if args.index_pool and not args.dists and not args.dists_file and not args.dists_db:
+        if verbosity >= 1:
+            timer.summary()
+        return
+
+    # archives: une par --pool, avec le --dists et le --mirror de même rang
+    pools = args.pool or ["debian"]
+    urls = args.mirror or ["http://ftp.fr.debian.org/debian/"]
+    if len(pools) > 1:
+        if len(args.dists or []) != len(pools) or args.dists_file or args.dists_db:
+            parser.error("several --pool need one --dists each")
+        if len(urls) not in (1, len(pools)):
+            parser.error("give one --mirror, or one per --pool")
+        if args.watch:
+            parser.error("--watch checks a single --pool")
+    for pool in pools:
+        if not os.path.isdir(pool):
+            debug(1, "not an existing dir: {}".format(pool))
+            sys.exit(1)
+    pools = [pool_root(pool) for pool in pools]
+    if len(urls) == 1:
+        urls = urls * len(pools)
+
+    m.db.close()
+
+    if len(pools) == 1:
+        try:
+            m, dists = check_archive(
+                args, pools[0], args.dists, args.dists_file, urls[0], m.tmp_dir, None, selection
+            )
+        except generation_error as e:
+            parser.error(str(e))
+
+    else:
+        # les archives sont vérifiées en parallèle, chacune dans son sous-répertoire de tmp_dir,
+        # la base (créée ou migrée ci-dessus) est partagée
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(pools)) as executor:
+            futures = [
+                executor.submit(
+                    _check_worker,
+                    args,
+                    pool,
+                    [dists],
+                    None,
+                    url,
+                    os.path.join(m.tmp_dir, archive_name(pool)),
+                    m.tmp_dir,
+                    selection,
+                )
+                for pool, dists, url in zip(pools, args.dists, urls)
+            ]
+            for pool, future in zip(pools, futures):
+                try:
+                    records = future.result()
+                except generation_error as e:
+                    parser.error("{}: {}".format(pool, e))
+                for record in records:
+                    record["phase"] = archive_name(pool) + " " + record["phase"]
+                    timer.phases.append(record)
+
+    if verbosity >= 1:
+        timer.summary()
+    if args.metrics:
+        timer.write(args.metrics, run)
+
+    if args.watch:
+        if not m.scanned:
+            m.set_pool(pools[0], True, args.scan_threads)
+
+        def reparse():
+            m.active_catalog = []
+            m.releases = dict()
+            parse_dists(m, args.dists, args.dists_file, args.parse_jobs)
+            if args.dists_db:
+                m.set_dists_db()
+
+        watcher(m, dists, reparse, args.watch_interval, args.status_port).run()
 
 
 if __name__ == "__main__":
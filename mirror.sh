@@ -72,9 +72,18 @@ rsync ${rsync_opt} --delete -a rsync://security.debian.org/debian-security/dists
 rsync ${rsync_opt} --delete -a rsync://security.debian.org/debian-security/dists/buster  ${root}/debian-security/dists
 
 
+#
+# update the shared pool index of both archives
+#
+./check.py -v --tmp-dir .tmp --index-pool ${mirror}/debian ${mirror}/debian-security
+
 #
 # check for missing files
 #
 ./check.py -vv --scan --tmp-dir .tmp \
         --pool=${mirror}/debian \
-        --dists="${mirror}/dists-mirror/debian/dists"
+        --dists="${mirror}/dists-mirror/debian/dists" \
+        --mirror=http://ftp.fr.debian.org/debian/ \
+        --pool=${mirror}/debian-security \
+        --dists="${mirror}/dists-mirror/debian-security/dists" \
+        --mirror=http://security.debian.org/debian-security/
@@ -0,0 +1,45 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_archive(root, packages, suite="buster", arch="amd64", extra=()):
+    """
+    crée une archive minimale: dists/<suite>/main/binary-<arch>/Packages et les fichiers
+    du pool (packages: noms des paquets), plus des fichiers en trop (extra)
+    retourne la liste des chemins listés
+    """
+    listed = []
+    stanzas = []
+    for name in packages:
+        filename = "pool/main/{}/{}/{}_1.0_{}.deb".format(name[0], name, name, arch)
+        data = "{} {}\n".format(name, arch).encode() * 10
+        path = os.path.join(root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        stanzas.append(
+            "Package: {}\nFilename: {}\nSize: {}\nMD5sum: {}\n".format(
+                name, filename, len(data), hashlib.md5(data).hexdigest()
+            )
+        )
+        listed.append(filename)
+    for filename in extra:
+        path = os.path.join(root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"extra\n")
+    catalog = os.path.join(root, "dists", suite, "main", "binary-" + arch, "Packages")
+    os.makedirs(os.path.dirname(catalog), exist_ok=True)
+    with open(catalog, "w") as f:
+        f.write("\n".join(stanzas))
+    return listed
+
+
+@pytest.fixture
+def archive():
+    return write_archive
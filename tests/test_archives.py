@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+CHECK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "check.py")
+
+
+def run_check(cwd, *args, timeout=120):
+    return subprocess.run(
+        [sys.executable, CHECK] + list(args),
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+    )
+
+
+def test_verify_hashes_several_archives(tmp_path, archive):
+    # deux archives vérifiées en parallèle écrivent leurs hash dans la même base
+    for name in ("a1", "a2"):
+        archive(str(tmp_path / name), ["pkg{}".format(i) for i in range(300)])
+    os.mkdir(tmp_path / "tmp")
+    for profile in ("default", "fast"):
+        r = run_check(
+            tmp_path,
+            "-p", "a1", "-d", "a1/dists",
+            "-p", "a2", "-d", "a2/dists",
+            "-s", "--verify-hashes", "--hash-jobs", "2",
+            "--db-profile", profile,
+            "-t", "tmp",
+        )  # fmt: skip
+        assert r.returncode == 0, r.stderr
+        assert r.stdout.count("All hashes are correct") == 2
+
+
+def test_archives_same_name(tmp_path, archive):
+    # debian/pool et debian-security/pool, ou deux racines de même nom: sorties séparées
+    archive(str(tmp_path / "x" / "mirror"), ["a", "b"], extra=["pool/main/z/z.deb"])
+    archive(str(tmp_path / "y" / "mirror"), ["c"])
+    os.mkdir(tmp_path / "tmp")
+    r = run_check(
+        tmp_path,
+        "-p", "x/mirror/pool", "-d", "x/mirror/dists",
+        "-p", "y/mirror/pool", "-d", "y/mirror/dists",
+        "-s", "-t", "tmp",
+    )  # fmt: skip
+    assert r.returncode == 0, r.stderr
+    excess = []
+    for name in os.listdir(tmp_path / "tmp"):
+        if name.startswith("mirror-"):
+            with open(tmp_path / "tmp" / name / "excess") as f:
+                excess.append(f.read().split())
+    assert sorted(excess) == [[], ["pool/main/z/z.deb"]]
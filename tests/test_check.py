@@ -0,0 +1,227 @@
+import io
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import check  # noqa: E402
+
+
+def test_stanzas():
+    data = (
+        b"Package: a\nFilename: pool/main/a/a_1_amd64.deb\nSize: 10\nMD5sum: 00ff\n"
+        b"Description: x\n continuation\n\n\n"
+        b"package: b\nfilename: pool/main/b/b_1_amd64.deb\nsize: 20\nSHA256: aa55\n"
+    )
+    rows = []
+    n = check.mirror._packages(io.BytesIO(data), lambda *row: rows.append(row), "Packages")
+    assert n == 2
+    assert rows == [
+        ("pool/main/a/a_1_amd64.deb", 10, "00ff"),
+        ("pool/main/b/b_1_amd64.deb", 20, "aa55"),
+    ]
+
+
+def test_sources():
+    data = (
+        b"Package: a\nDirectory: pool/main/a\nChecksums-Sha256:\n"
+        b" 1111 5 a_1.dsc\n 2222 50 a_1.tar.xz\n"
+    )
+    rows = []
+    n = check.mirror._sources(io.BytesIO(data), lambda *row: rows.append(row), "Sources")
+    assert n == 2
+    assert rows == [("pool/main/a/a_1.dsc", 5, "1111"), ("pool/main/a/a_1.tar.xz", 50, "2222")]
+
+
+def test_dists_filter():
+    f = check.dists_filter(archs=["amd64", "hurd-i386"])
+    assert f.unwanted("main/binary-i386/Packages.gz")
+    assert f.unwanted("main/Contents-i386.gz")
+    assert f.unwanted("main/Contents-udeb-i386.gz")
+    assert f.unwanted("main/installer-i386/current")
+    assert not f.unwanted("main/binary-hurd-i386/Packages.gz")
+    assert not f.unwanted("main/binary-amd64/Packages.gz")
+    assert not f.unwanted("main/binary-all/Packages.gz")
+    assert not f.unwanted("main/source/Sources.gz")
+
+    f = check.dists_filter(archs=["kfreebsd-amd64"])
+    assert not f.unwanted("main/binary-kfreebsd-amd64/Packages")
+    assert f.unwanted("main/binary-amd64/Packages")
+
+    f = check.dists_filter(sections=["main"])
+    assert not f.unwanted("main/binary-amd64/Packages")
+    assert f.unwanted("contrib/binary-amd64/Packages")
+    assert not f.unwanted("main/debian-installer/binary-amd64/Packages")
+
+    assert not check.dists_filter().unwanted("main/binary-amd64/Packages")
+
+
+def test_migrate_baseline_schema(tmp_path):
+    # base créée par la première version de check.py
+    db = sqlite3.connect(str(tmp_path / "mirror.db"))
+    db.executescript(
+        """
+create table catalog (
+    catalog_id  integer not null primary key autoincrement,
+    filename    text not null,
+    timestamp   datetime,
+    size        integer,
+    done        boolean,
+    count       integer
+);
+create table package (
+    catalog_id  integer not null,
+    filename    text not null,
+    size        integer,
+    hash        text
+);
+create table pool (
+    filename    text not null,
+    size        integer not null
+);
+create table pool_scanned (
+    filename    text not null,
+    timestamp   datetime not null
+);
+create index catalog_fk on package (filename);
+create index package_fk on package (catalog_id);
+insert into catalog values (1, 'dists/x/main/binary-amd64/Packages', 1.0, 10, 1, 3);
+insert into package values (1, 'pool/main/a/a.deb', 10, 'aa');
+insert into package values (1, 'pool/main/b/b.deb', 20, 'bb');
+insert into package values (1, 'pool/main/c/c.deb', null, null);
+insert into pool values ('pool/main/a/a.deb', 10);
+insert into pool_scanned values ('/srv/debian', 2.0);
+"""
+    )
+    db.commit()
+    db.close()
+
+    m = check.mirror(str(tmp_path))
+
+    def columns(table):
+        return [row[1] for row in m.db.execute("pragma table_info({})".format(table))]
+
+    assert columns("package") == ["catalog_id", "file_id"]
+    for column in ("sha256", "replaced", "root"):
+        assert column in columns("catalog")
+    assert "version" in columns("pool_scanned")
+    assert "root" in columns("digest")
+
+    rows = m.db.execute(
+        "select f.filename,f.size,f.hash from package p join file f on f.file_id=p.file_id"
+        " where p.catalog_id=1 order by 1"
+    ).fetchall()
+    assert rows == [
+        ("pool/main/a/a.deb", 10, "aa"),
+        ("pool/main/b/b.deb", 20, "bb"),
+        ("pool/main/c/c.deb", -1, ""),
+    ]
+    assert m.db.execute("select root,filename,size,hash from pool").fetchall() == [
+        ("/srv/debian", "pool/main/a/a.deb", 10, check.pool_index.key("pool/main/a/a.deb"))
+    ]
+
+    # une seconde ouverture ne migre plus rien
+    m.db.close()
+    m = check.mirror(str(tmp_path))
+    assert m.db.execute("select count(*) from package").fetchone()[0] == 3
+
+
+def test_pool_index(tmp_path):
+    m = check.mirror(str(tmp_path))
+    files = {"pool/main/{}.deb".format(i): i * 10 for i in range(100)}
+    m.db.executemany(
+        "insert into pool (root,filename,size,hash) values (?,?,?,?)",
+        [("r", name, size, check.pool_index.key(name)) for name, size in files.items()],
+    )
+    m.db.execute(
+        "insert into pool (root,filename,size,hash) values ('other','x.deb',1,?)",
+        [check.pool_index.key("x.deb")],
+    )
+
+    index = check.pool_index.from_db(m.db.cursor(), "r")
+    assert len(index) == 100
+    assert "x.deb" not in index
+
+    filename = str(tmp_path / "pool.idx")
+    index.save(filename, 3)
+    assert check.pool_index.load(filename, 4) is None
+    mapped = check.pool_index.load(filename, 3)
+    assert len(mapped) == 100
+    for name, size in files.items():
+        assert mapped.get(name) == size
+    assert mapped.get("pool/main/none.deb", -1) == -1
+
+    # modifications gardées à part du fichier projeté
+    mapped["pool/main/new.deb"] = 5
+    assert mapped.pop("pool/main/1.deb") == 10
+    assert "pool/main/1.deb" not in mapped
+    assert mapped.get("pool/main/new.deb") == 5
+    assert len(mapped) == 100
+
+
+def test_lookup_index(tmp_path):
+    filename = str(tmp_path / "lookup.idx")
+    rows = [
+        ("pool/main/a/a.deb", 10, 10, "00" * 16),
+        ("pool/main/b/b.deb", 20, -1, "11" * 32),
+        ("pool/main/c/c.deb", 30, 31, "22" * 16),
+        ("pool/main/z/z.deb", -1, 5, None),
+        ("pool/main/é/é.deb", 1, 1, ""),
+    ]
+    assert check.lookup_index.write(filename, iter(rows), 1.5) == 5
+    assert not os.path.exists(filename + ".tmp")
+
+    index = check.lookup_index.load(filename)
+    assert len(index) == 5
+    assert index.timestamp == 1.5
+    assert index.lookup("pool/main/a/a.deb") == (True, 10, "00" * 16)
+    assert index.lookup("pool/main/b/b.deb") == (False, 20, "11" * 32)
+    assert index.lookup("pool/main/c/c.deb") == (False, 30, "22" * 16)
+    assert index.lookup("pool/main/z/z.deb") == (True, 5, None)
+    assert index.lookup("pool/main/é/é.deb") == (True, 1, "")
+    assert index.lookup("pool/main/0.deb") is None
+    assert index.lookup("pool/main/zz.deb") is None
+    assert "pool/main/c/c.deb" in index
+    index.close()
+
+    with open(filename, "r+b") as f:
+        f.truncate(100)
+    assert check.lookup_index.load(filename) is None
+    assert check.lookup_index.load(str(tmp_path / "none.idx")) is None
+
+
+def write_packages(filename, entries):
+    with open(filename, "w") as f:
+        for name, size, md5 in entries:
+            f.write("Package: x\nFilename: {}\nSize: {}\nMD5sum: {}\n\n".format(name, size, md5))
+
+
+def test_generation_diff(tmp_path):
+    dists = tmp_path / "dists"
+    catalog = dists / "x" / "main" / "binary-amd64" / "Packages"
+    os.makedirs(str(catalog.parent))
+    write_packages(str(catalog), [("a.deb", 1, "aa"), ("b.deb", 2, "bb"), ("c.deb", 3, "cc")])
+
+    m = check.mirror(str(tmp_path), archive="r")
+    m.parse_files([(str(catalog), str(dists))])
+    first = m.save_generation()
+
+    write_packages(
+        str(catalog), [("a.deb", 1, "aa"), ("c.deb", 30, "cc2"), ("d.deb", 4, "dd"), ("e", 5, "e")]
+    )
+    os.utime(str(catalog), (1, 1))
+    m.active_catalog = []
+    m.parse_files([(str(catalog), str(dists))])
+    second = m.save_generation()
+    assert second != first
+
+    delta = m.diff()
+    assert delta == {
+        "added": {"d.deb": 4, "e": 5},
+        "removed": {"b.deb": 2},
+        "changed": {"c.deb": 30},
+    }
+    with open(str(tmp_path / "diff.removed")) as f:
+        assert f.read().split() == ["b.deb"]
+    assert m.diff(second, first)["removed"] == {"d.deb": 4, "e": 5}
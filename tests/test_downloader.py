@@ -0,0 +1,163 @@
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import check  # noqa: E402
+
+
+CONTENT = bytes(range(256)) * 64
+
+
+class handler(http.server.BaseHTTPRequestHandler):
+    """
+        /file: Range respecté (206)
+        /norange: Range ignoré (200 et fichier complet)
+        /changed: Range refusé (416), fichier complet sinon
+        /missing: 404
+        /short: taille annoncée différente de celle attendue par l'appelant
+        /redirect: redirection vers /file sur le même hôte
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        rng = self.headers.get("Range")
+        if self.path == "/missing":
+            self._send(404, b"")
+            return
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/file")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = CONTENT[:1000] if self.path == "/short" else CONTENT
+        if rng and self.path == "/changed":
+            self._send(416, b"")
+        elif rng and self.path == "/file":
+            start = int(rng.split("=")[1].rstrip("-"))
+            self._send(206, body[start:])
+        else:
+            self._send(200, body)
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(check.time, "sleep", lambda seconds: None)
+
+
+def url(server, path):
+    return "http://127.0.0.1:{}{}".format(server.server_address[1], path)
+
+
+def test_fetch(server, tmp_path):
+    dest = str(tmp_path / "pool" / "a.deb")
+    assert check.downloader().fetch(url(server, "/file"), dest, len(CONTENT))
+    with open(dest, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(dest + ".part")
+
+
+def test_resume(server, tmp_path):
+    dest = str(tmp_path / "a.deb")
+    with open(dest + ".part", "wb") as f:
+        f.write(CONTENT[:5000])
+    d = check.downloader()
+    assert d.fetch(url(server, "/file"), dest, len(CONTENT))
+    assert server.requests == [("/file", "bytes=5000-")]
+    assert d.bytes == len(CONTENT) - 5000
+    with open(dest, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_resume_ignored(server, tmp_path):
+    # le serveur renvoie tout le fichier: la partie déjà reçue est réécrite
+    dest = str(tmp_path / "a.deb")
+    with open(dest + ".part", "wb") as f:
+        f.write(b"x" * 5000)
+    assert check.downloader().fetch(url(server, "/norange"), dest, len(CONTENT))
+    with open(dest, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_resume_refused(server, tmp_path):
+    # 416: le fichier partiel est abandonné, la tentative suivante repart de zéro
+    dest = str(tmp_path / "a.deb")
+    with open(dest + ".part", "wb") as f:
+        f.write(b"x" * 5000)
+    assert check.downloader(retries=1).fetch(url(server, "/changed"), dest, len(CONTENT))
+    assert server.requests == [("/changed", "bytes=5000-"), ("/changed", None)]
+    with open(dest, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_client_error(server, tmp_path):
+    # 404: pas de nouvelle tentative, pas de fichier partiel
+    dest = str(tmp_path / "a.deb")
+    assert not check.downloader(retries=3).fetch(url(server, "/missing"), dest, 10)
+    assert server.requests == [("/missing", None)]
+    assert not os.path.exists(dest)
+    assert not os.path.exists(dest + ".part")
+
+
+def test_size_mismatch(server, tmp_path):
+    # taille différente de celle du catalogue: échec après les tentatives, rien n'est gardé
+    dest = str(tmp_path / "a.deb")
+    assert not check.downloader(retries=2).fetch(url(server, "/short"), dest, len(CONTENT))
+    assert len(server.requests) == 3
+    assert not os.path.exists(dest)
+    assert not os.path.exists(dest + ".part")
+
+
+def test_run(server, tmp_path):
+    work = [
+        (url(server, "/file"), str(tmp_path / "a.deb"), len(CONTENT)),
+        (url(server, "/missing"), str(tmp_path / "b.deb"), 10),
+    ]
+    done = []
+    failed = check.downloader(jobs=2, retries=0).run(work, lambda *args: done.append(args))
+    assert failed == {str(tmp_path / "b.deb")}
+    assert done == [(str(tmp_path / "a.deb"), len(CONTENT))]
+
+
+def test_redirect_same_host(server, tmp_path):
+    # une seule place par hôte: la redirection ne doit pas attendre la place déjà prise
+    dest = str(tmp_path / "a.deb")
+    d = check.downloader(jobs=1, host_jobs=1, retries=0)
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(d.fetch(url(server, "/redirect"), dest, len(CONTENT))),
+        daemon=True,
+    )
+    thread.start()
+    thread.join(10)
+    assert result == [True]
+    assert server.requests == [("/redirect", None), ("/file", None)]
+    with open(dest, "rb") as f:
+        assert f.read() == CONTENT